@@ -99,42 +99,72 @@ function listen(type, evt) {
 	console.log(type, evt);
 }
 
+// Parameters for running matches in the table.
+var TableParam = {
+	health: 100,
+	speed: 10,
+	teamSize: 2,
+};
+
+function parseCount(itercount) {
+	itercount = parseInt(itercount);
+	if (!(itercount > 0)) {
+		console.log('No iterations');
+		process.exit(1);
+	}
+	return itercount;
+}
+
+// Run a match and get the fraction of games won by each side.
+function runMatch(match, itercount) {
+	match.run(Object.assign({count: itercount}, TableParam));
+	return {
+		shape1: match.shape1,
+		shape2: match.shape2,
+		wins1: match.wins1 / itercount,
+		wins2: match.wins2 / itercount,
+		turns: match.turns / itercount,
+	};
+}
+
 var Commands = {
 	table: function(itercount) {
-		itercount = parseInt(itercount);
-		if (itercount <= 0) {
-			console.log('No iterations');
-			process.exit(1);
-		}
+		itercount = parseCount(itercount);
 		var matches = sim.matchAll();
-		var param = {
-			health: 100,
-			speed: 10,
-			teamSize: 2,
-			count: itercount,
-		};
 		var results = [];
 		for (var i = 0; i < matches.length; i++) {
-			var match = matches[i];
-			match.run(param);
-			results.push({
-				shape1: match.shape1,
-				shape2: match.shape2,
-				wins1: match.wins1 / itercount,
-				wins2: match.wins2 / itercount,
-				turns: match.turns / itercount,
-			});
+			results.push(runMatch(matches[i], itercount));
 		}
 		dumpTable(process.stdout, results);
 	},
 	combat: function(shape1, shape2) {
-		var param = {
-			health: 100,
-			speed: 10,
-			teamSize: 2,
-		};
 		var match = new sim.Match(shape1, shape2);
-		match.run(param, listen);
+		match.run(TableParam, listen);
+	},
+	// Commands used by tools/combatsim.py to run the table in parallel.
+	pairs: function() {
+		var matches = sim.matchAll();
+		console.log(JSON.stringify({
+			param: TableParam,
+			pairs: matches.map(function(m) { return [m.shape1, m.shape2]; }),
+		}));
+	},
+	match: function(itercount) {
+		itercount = parseCount(itercount);
+		var results = [];
+		for (var i = 1; i < arguments.length; i++) {
+			var pair = arguments[i].split(',');
+			results.push(runMatch(new sim.Match(pair[0], pair[1]), itercount));
+		}
+		console.log(JSON.stringify(results));
+	},
+	dump: function() {
+		var chunks = [];
+		process.stdin.setEncoding('utf8');
+		process.stdin.on('data', function(chunk) { chunks.push(chunk); });
+		process.stdin.on('end', function() {
+			dumpTable(process.stdout, JSON.parse(chunks.join('')));
+		});
 	},
 };
 
@@ -144,7 +174,10 @@ var Commands = {
 		console.log(
 			'Commands:\n' +
 				'    table ITERCOUNT\n' +
-				'    combat SHAPE SHAPE'
+				'    combat SHAPE SHAPE\n' +
+				'    pairs\n' +
+				'    match ITERCOUNT SHAPE,SHAPE...\n' +
+				'    dump < RESULTS.json'
 		);
 		process.exit(1);
 	}
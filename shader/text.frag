@@ -4,8 +4,17 @@ varying vec2 vTexCoord;
 varying vec4 vColor;
 
 uniform sampler2D Font;
+#ifdef SDF
+// Half-width of the antialiased edge, in distance field units.
+uniform float Smoothing;
+#endif
 
 void main() {
+#ifdef SDF
+    float d = texture2D(Font, vTexCoord).r;
+    float a = smoothstep(0.5 - Smoothing, 0.5 + Smoothing, d);
+#else
     float a = texture2D(Font, vTexCoord).r;
+#endif
     gl_FragColor = a * vColor;
 }
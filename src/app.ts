@@ -12,11 +12,10 @@ import './util'
 
 import * as input from './input';
 import * as state from './state';
-import { GameScreen } from './game';
 import { LoadScreen } from './load';
 
+// The game screen is registered by the game chunk, when it loads.
 state.register({
-	Game: () => { return new GameScreen(); },
 	Load: () => { return new LoadScreen(); },
 });
 state.set('Load', null);
@@ -16,28 +16,101 @@ declare module Assets {
 		bold: boolean;
 		italic: boolean;
 		size: number;
+		// Distance field spread in pixels, if the font is a distance field
+		sdf?: number;
 		ascender: number;
 		descender: number;
 		height: number;
 		char: string;
+		// Offsets into the font data, see tools/font.py
+		glyphOffset: number;
+		kernOffset: number;
+		kernCount: number;
+		// Tables created from the font data when loaded
 		glyphcount: number;
-		glyph: Int16Array; // initially a string
-		kern: Int8Array; // initially a string
+		glyph: Int16Array;
+		kernIndex: Uint16Array;
+		kernRight: Int16Array;
+		kernAmount: Int16Array;
+	}
+
+	interface ImageVariant {
+		path: string;
+		// MIME type of the image
+		type: string;
+		// Size in bytes
+		size: number;
 	}
 
 	interface ImageSetInfo {
-		[name: string]: string;
+		// Variants of each image, smallest first
+		[name: string]: ImageVariant[];
+	}
+
+	interface PackEntry {
+		// Location of the file in the pack, in bytes
+		offset: number;
+		length: number;
+		// MIME type of the file
+		type: string;
+	}
+
+	interface PackInfo {
+		path: string;
+		// MIME type of images in the pack
+		imageType: string;
+		// Size in bytes
+		size: number;
+		// Files in the pack: "fontData", or "images/" and the image name
+		entries: { [name: string]: PackEntry };
+	}
+
+	interface TextLayoutInfo {
+		// Location of the glyphs in the font data, in bytes
+		offset: number;
+		// Number of glyphs
+		count: number;
+		// Layout metrics, see text.LayoutMetrics
+		x0: number;
+		y0: number;
+		x1: number;
+		y1: number;
+		adv: number;
+		// Glyphs created from the font data when loaded, see
+		// tools/textlayout.py
+		glyphs: Int16Array;
 	}
 
 	interface SpriteMap {
 		[name: string]: number[];
 	}
 
+	interface ShaderSources {
+		// Distinct shader source code
+		text: string[];
+		// Map from shader name to index in text
+		index: { [name: string]: number };
+	}
+
 	interface AssetInfo {
 		fonts: FontInfo[];
+		// Path to binary glyph and kerning tables for all fonts, and
+		// glyphs for static text layouts
+		fontData: string;
 		images: ImageSetInfo;
+		// Asset packs, smallest first, if enabled
+		packs?: PackInfo[];
 		sprites: SpriteMap;
+		// Static text, laid out by the build system
+		text: { [name: string]: TextLayoutInfo };
 	}
 }
 
 declare var AssetInfo: Assets.AssetInfo;
+
+/*
+ * Shader source code.  This is produced by the build system and loaded
+ * by a separate script, so shader changes do not change the
+ * application code.
+ */
+declare var ShaderSources: Assets.ShaderSources;
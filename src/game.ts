@@ -100,3 +100,7 @@ export class GameScreen implements state.Screen, time.TimeTarget {
 		var move = ctl.move.value;
 	}
 }
+
+state.register({
+	Game: () => { return new GameScreen(); },
+});
@@ -23,16 +23,95 @@ var Loaded = false;
 var Images: ImageSet;
 var Levels: LevelSet;
 
+/*
+ * Get the URL for an asset path, which may be an inlined data URI.
+ */
+function assetURL(base: string, path: string): string {
+	return /^data:/.test(path) ? path : base + path;
+}
+
+// Image types the browser can decode.
+var ImageTypes: { [type: string]: boolean } = {
+	'image/jpeg': true,
+	'image/png': true,
+};
+
+/*
+ * Check which optional image types the browser can decode.
+ *
+ * func: Callback when complete
+ */
+function checkImageTypes(func: () => void) {
+	var img = new Image();
+	function done() {
+		ImageTypes['image/webp'] = img.width > 0 && img.height > 0;
+		func();
+	}
+	img.addEventListener('load', done, false);
+	img.addEventListener('error', done, false);
+	// 1x1 lossless WebP image
+	img.src = 'data:image/webp;base64,' +
+		'UklGRhoAAABXRUJQVlA4TA0AAAAvAAAAEAcQERGIiP4HAA==';
+}
+
+/*
+ * Download a file as an ArrayBuffer.
+ *
+ * func: Callback with the file contents
+ */
+function fetchBuffer(url: string, func: (buf: ArrayBuffer) => void) {
+	var req = new XMLHttpRequest();
+	req.open('GET', url);
+	req.responseType = 'arraybuffer';
+	req.addEventListener('load', () => {
+		func(<ArrayBuffer> req.response);
+	}, false);
+	req.send();
+}
+
+/*
+ * Set the binary glyph and kerning tables for all fonts, and the
+ * glyphs for static text.
+ */
+function setFontData(buf: ArrayBuffer) {
+	_.forEach(AssetInfo.fonts, (font: Assets.FontInfo) => {
+		var n = font.char.length;
+		font.glyphcount = n;
+		font.glyph = new Int16Array(buf, font.glyphOffset, n * 7);
+		font.kernIndex = new Uint16Array(buf, font.kernOffset, n + 1);
+		var pos = font.kernOffset + (n + 1) * 2, k = font.kernCount;
+		font.kernRight = new Int16Array(buf, pos, k);
+		font.kernAmount = new Int16Array(buf, pos + k * 2, k);
+	});
+	_.forOwn(AssetInfo.text, (layout: Assets.TextLayoutInfo) => {
+		layout.glyphs = new Int16Array(buf, layout.offset, layout.count * 10);
+	});
+}
+
+/*
+ * Load the binary glyph and kerning tables for all fonts.
+ *
+ * func: Callback when complete
+ */
+function loadFontData(func: () => void) {
+	fetchBuffer(AssetInfo.fontData, (buf: ArrayBuffer) => {
+		setFontData(buf);
+		func();
+	});
+}
+
 /*
  * Load all images.
  *
+ * urls: Map from image names to URLs for images which are already
+ *   downloaded, from an asset pack
  * func: Callback when complete
  */
-function loadImages(func: () => void) {
+function loadImages(urls: { [name: string]: string }, func: () => void) {
 	Images = {};
 	var info = AssetInfo.images;
 	var count = _.size(info), loaded = 0;
-	_.forOwn(info, (path: string, name: string) => {
+	_.forOwn(info, (variants: Assets.ImageVariant[], name: string) => {
 		var img = new Image();
 		img.addEventListener('load', () => {
 			loaded++;
@@ -40,7 +119,14 @@ function loadImages(func: () => void) {
 				func();
 			}
 		}, false);
-		img.src = 'images/' + path;
+		if (urls.hasOwnProperty(name)) {
+			img.src = urls[name];
+		} else {
+			// Variants are sorted by size, so use the first supported one.
+			var variant = _.find(
+				variants, (v: Assets.ImageVariant) => ImageTypes[v.type]);
+			img.src = assetURL('images/', variant.path);
+		}
 		Images[name] = img;
 	});
 	if (!count) {
@@ -48,6 +134,41 @@ function loadImages(func: () => void) {
 	}
 }
 
+/*
+ * Load images and font data from an asset pack.
+ *
+ * func: Callback when complete
+ */
+function loadPack(pack: Assets.PackInfo, func: () => void) {
+	fetchBuffer(pack.path, (buf: ArrayBuffer) => {
+		var urls: { [name: string]: string } = {};
+		var hasFontData = false;
+		_.forOwn(pack.entries, (entry: Assets.PackEntry, name: string) => {
+			var data = buf.slice(entry.offset, entry.offset + entry.length);
+			if (name == 'fontData') {
+				setFontData(data);
+				hasFontData = true;
+			} else if (/^images\//.test(name)) {
+				urls[name.substring(7)] = URL.createObjectURL(
+					new Blob([data], { type: entry.type }));
+			}
+		});
+		var count = 1, loaded = 0;
+		function func2() {
+			loaded++;
+			if (loaded >= count) {
+				func();
+			}
+		}
+		if (!hasFontData) {
+			// The font data was inlined instead.
+			count++;
+			loadFontData(func2);
+		}
+		loadImages(urls, func2);
+	});
+}
+
 /*
  * Get an image by name.
  */
@@ -77,32 +198,20 @@ function loadAll(func: () => void) {
 			func();
 		}
 	}
-	_.forEach(AssetInfo.fonts, (font: Assets.FontInfo) => {
-		font.glyph = new Int16Array(
-			_.map(
-				(<any> font.glyph).split(','),
-				(s: string) => { return parseInt(s); }));
-		var nglyph = (font.glyph.length / 7) | 0;
-		font.glyphcount = nglyph;
-		if (font.kern) {
-			var kstr = <string> (<any> font).kern;
-			var kern = new Int8Array(nglyph * nglyph);
-			_.forEach(
-				kstr.split(':'),
-				(gkern: string) => {
-					var d = _.map(gkern.split(','), (s: string) => parseInt(s));
-					var left = d[0];
-					var n = ((d.length - 1) / 2) | 0;
-					for (var i = 0; i < n; i++) {
-						var right = d[i * 2 + 1];
-						var amt = d[i * 2 + 2];
-						kern[left * nglyph + right] = amt;
-					}
-				});
-			font.kern = kern;
+	count++;
+	state.whenRegistered('Game', func2);
+	checkImageTypes(() => {
+		// Packs are sorted by size, so use the first supported one.
+		var pack = _.find(
+			AssetInfo.packs, (p: Assets.PackInfo) => ImageTypes[p.imageType]);
+		if (pack) {
+			loadPack(pack, func2);
+		} else {
+			count++;
+			loadFontData(func2);
+			loadImages({}, func2);
 		}
 	});
-	loadImages(func2);
 }
 
 /*
@@ -13,28 +13,56 @@ export interface Program {
 	program: WebGLProgram;
 }
 
-export interface ShaderSources {
-	[name: string]: string;
-}
-
 export interface ProgramInfo {
 	name: string;
 	vert: string;
 	frag: string;
 	unif: string;
 	attr: string;
+	variants: string;
+}
+
+/*
+ * A context with its loaded programs, by attributes and source
+ * indexes.  Variants which have identical source code share the same
+ * program.  Programs only work with the context that created them, so
+ * each context has its own cache.
+ */
+interface ProgramContext extends WebGLRenderingContext {
+	programCache?: { [key: string]: Program };
 }
 
 /*
  * Load a complete WebGL program, null on error.
  */
 export function loadProgram(gl: WebGLRenderingContext,
-														sources: ShaderSources,
+														sources: Assets.ShaderSources,
 														info: ProgramInfo,
 														vert: string,
-														frag: string): Program
+														frag: string,
+														variant?: string): Program
 {
 	var name = info.name + ',' + vert + ',' + frag;
+	var suffix = '';
+	if (variant) {
+		if (!_.includes(info.variants.split(' '), variant)) {
+			console.error(info.name + ': no such variant: ' + variant);
+			return null;
+		}
+		name += ',' + variant;
+		suffix = ':' + variant;
+	}
+	var vidx = sources.index[vert + '.vert' + suffix];
+	var fidx = sources.index[frag + '.frag' + suffix];
+	var key = info.attr + ',' + info.unif + ',' + vidx + ',' + fidx;
+	var cache = (<ProgramContext> gl).programCache;
+	if (!cache) {
+		cache = {};
+		(<ProgramContext> gl).programCache = cache;
+	}
+	if (cache.hasOwnProperty(key)) {
+		return cache[key];
+	}
 	var specs = [{
 		type: 'vert',
 		name: vert,
@@ -54,13 +82,13 @@ export function loadProgram(gl: WebGLRenderingContext,
 			break;
 		}
 		var shader = gl.createShader(gtype);
-		var source = sources[fullname];
+		var source = sources.text[sources.index[fullname + suffix]];
 		if (!source) {
-			console.error('Missing shader source: ' + fullname);
+			console.error('Missing shader source: ' + fullname + suffix);
 			gl.deleteShader(shader)
 			break;
 		}
-		gl.shaderSource(shader, sources[fullname]);
+		gl.shaderSource(shader, source);
 		gl.compileShader(shader);
 		if (!gl.getShaderParameter(shader, gl.COMPILE_STATUS)) {
 			console.log('Errors for shader: ' + fullname);
@@ -94,5 +122,6 @@ export function loadProgram(gl: WebGLRenderingContext,
 		*/
 		(<any> obj)[uname] = loc;
 	}
+	cache[key] = obj;
 	return obj;
 }
@@ -46,6 +46,8 @@ var current: Screen = null;
 var pending: PendingScreen = null;
 // All screens: initially functions, later objects.
 var screens: { [name: string]: AnyScreen } = {};
+// Callbacks waiting for screens to be registered.
+var waiting: { [name: string]: (() => void)[] } = {};
 
 /*
  * Register screens.
@@ -55,6 +57,27 @@ var screens: { [name: string]: AnyScreen } = {};
  */
 export function register(newScreens: ScreenSet): void {
 	_.defaults(screens, newScreens);
+	_.forOwn(newScreens, (screen: ScreenConstructor, name: string) => {
+		var funcs = waiting[name];
+		if (funcs) {
+			delete waiting[name];
+			_.forEach(funcs, (func: () => void) => { func(); });
+		}
+	});
+}
+
+/*
+ * Call a function once a screen is registered.  Screens in feature
+ * chunks are registered when the chunk loads.
+ */
+export function whenRegistered(name: string, func: () => void): void {
+	if (screens.hasOwnProperty(name)) {
+		func();
+	} else if (waiting.hasOwnProperty(name)) {
+		waiting[name].push(func);
+	} else {
+		waiting[name] = [func];
+	}
 }
 
 /*
@@ -34,6 +34,8 @@ var Program: shader.TextProgram = null;
 // The font texture
 var FontTexture: WebGLTexture = null;
 var TexScale: Float32Array = new Float32Array(2);
+// Edge smoothing for distance field fonts, or 0 for alpha fonts
+var Smoothing: number = 0;
 
 export function init(gl: WebGLRenderingContext): void {
 	if (Loaded) {
@@ -41,7 +43,11 @@ export function init(gl: WebGLRenderingContext): void {
 	}
 	Loaded = true;
 
-	Program = shader.textProgram(gl, 'text', 'text');
+	// Distance field fonts are drawn with a different shader, and all
+	// fonts in the atlas must use the same mode.
+	var sdf = AssetInfo.fonts.length ? AssetInfo.fonts[0].sdf || 0 : 0;
+	Program = shader.textProgram(gl, 'text', 'text', sdf ? 'SDF' : null);
+	Smoothing = sdf ? 0.25 / sdf : 0;
 
 	var img = load.getImage('fonts');
 	if (img) {
@@ -49,9 +55,11 @@ export function init(gl: WebGLRenderingContext): void {
 		gl.bindTexture(gl.TEXTURE_2D, FontTexture);
 		gl.texImage2D(
 			gl.TEXTURE_2D, 0, gl.LUMINANCE, gl.LUMINANCE, gl.UNSIGNED_BYTE, img);
-		gl.texParameteri(gl.TEXTURE_2D, gl.TEXTURE_MAG_FILTER, gl.NEAREST);
 		gl.texParameteri(
-			gl.TEXTURE_2D, gl.TEXTURE_MIN_FILTER, gl.NEAREST_MIPMAP_NEAREST);
+			gl.TEXTURE_2D, gl.TEXTURE_MAG_FILTER, sdf ? gl.LINEAR : gl.NEAREST);
+		gl.texParameteri(
+			gl.TEXTURE_2D, gl.TEXTURE_MIN_FILTER,
+			sdf ? gl.LINEAR_MIPMAP_LINEAR : gl.NEAREST_MIPMAP_NEAREST);
 		gl.generateMipmap(gl.TEXTURE_2D);
 		gl.bindTexture(gl.TEXTURE_2D, null);
 		TexScale[0] = 1 / img.width;
@@ -150,6 +158,9 @@ class TextLayer {
 		gl.uniformMatrix4fv(p.MVP, false, camera.uiMVP);
 		gl.uniform2fv(p.TexScale, TexScale);
 		gl.uniform1i(p.Font, 0);
+		if (Smoothing) {
+			gl.uniform1f(p.Smoothing, Smoothing);
+		}
 		gl.uniform4fv(p.Color, [
 			0, 1, 1, 1,
 			1, 0, 1, 1,
@@ -391,10 +402,17 @@ export class Builder {
 				this._gatt[j] = AttrMap[c] || 0;
 			}
 		}
-		if (finfo.kern && false) {
-			var n = finfo.glyphcount, kern = finfo.kern;
-			for (var i = i0; i < i1; i++) {
-				this._gadv[i] += kern[gidx[i] * n + gidx[i + 1]];
+		if (finfo.kernCount && false) {
+			var kidx = finfo.kernIndex, kright = finfo.kernRight,
+					kamt = finfo.kernAmount;
+			for (var i = 0; i + 1 < n; i++) {
+				var right = gidx[i + 1];
+				for (var k = kidx[gidx[i]], e = kidx[gidx[i] + 1]; k < e; k++) {
+					if (kright[k] == right) {
+						this._gadv[i0 + i] += kamt[k] * scale;
+						break;
+					}
+				}
 			}
 		}
 		this._size = i1;
@@ -592,6 +610,23 @@ export class Builder {
 	}
 }
 
+/*
+ * Get the metrics of static text laid out by the build system.
+ */
+export function staticMetrics(name: string): LayoutMetrics {
+	var layout = AssetInfo.text[name];
+	if (!layout) {
+		return null;
+	}
+	var r = new LayoutMetrics();
+	r.x0 = layout.x0;
+	r.y0 = layout.y0;
+	r.x1 = layout.x1;
+	r.y1 = layout.y1;
+	r.adv = layout.adv;
+	return r;
+}
+
 /********************************************************************/
 
 export interface TextAddOptions {
@@ -656,8 +691,25 @@ export class TextObject {
 	 * Add a built layout to the text object.
 	 */
 	addLayout(b: Builder, options?: TextAddOptions): void {
+		this._addGlyphs(b._gdat, b._size, options);
+	}
+
+	/*
+	 * Add static text to the text object.  The text was laid out by the
+	 * build system, see assets/layout.yaml.
+	 */
+	addStatic(name: string, options?: TextAddOptions): void {
+		var layout = AssetInfo.text[name];
+		if (!layout) {
+			console.warn('No such static text: ' + name);
+			return;
+		}
+		this._addGlyphs(layout.glyphs, layout.count, options);
+	}
+
+	_addGlyphs(gdat: Int16Array, n: number, options?: TextAddOptions): void {
 		var { x = 0, y = 0 } = options || {};
-		var gdat = b._gdat, n = b._size, q = 0;
+		var q = 0;
 		for (var i = 0; i < n; i++) {
 			if (gdat[i*10+0] == gdat[i*10+2] || gdat[i*10+1] == gdat[i*10+3]) {
 				continue;
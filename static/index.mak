@@ -4,6 +4,16 @@
     <meta charset="UTF-8">
     <title>${title|h}</title>
     <style type="text/css">${css_data|h}</style>
+% for link in links:
+    <link rel="${link['rel']}" href="${link['href']|h}" as="${link['as']}"\
+% if 'type' in link:
+ type="${link['type']}"\
+% endif
+% if link['as'] == 'fetch':
+ crossorigin="anonymous"\
+% endif
+>
+% endfor
   </head>
   <body>
     <div id="main">
@@ -14,6 +24,9 @@
       <h1>${title|h}</h1>
       ${instructions}
     </div>
+% for text in inline_scripts:
+    <script type="text/javascript">${text}</script>
+% endfor
     <script type="text/javascript">${js_data}</script>
   </body>
 </html>
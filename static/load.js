@@ -29,6 +29,17 @@
 		gl = null;
 	}
 
+	// Service worker script, in release builds.  It is registered after
+	// the page loads, so it does not compete with the game for bandwidth.
+	var SERVICE_WORKER = null;
+	if (SERVICE_WORKER && 'serviceWorker' in navigator) {
+		window.addEventListener('load', function() {
+			navigator.serviceWorker.register(SERVICE_WORKER).catch(function(e) {
+				console.warn('Could not register service worker', e);
+			});
+		}, false);
+	}
+
 	var maindiv = document.getElementById('game');
 	canvas = document.createElement('canvas');
 	maindiv.appendChild(canvas);
@@ -39,8 +50,24 @@
 		return fail(ERR_WEBGL);
 	}
 
+	// Boot scripts, which run in order and start the loading screen.
 	var SCRIPTS = [];
+	// Feature chunks, which are requested in parallel once the boot
+	// scripts have loaded, so the boot scripts get all the bandwidth.
+	var CHUNKS = [];
 	var remaining = SCRIPTS.length;
+	function scriptErr() {
+		fail(ERR_SCRIPT);
+	}
+	function addScript(src, onload) {
+		var script = document.createElement('script');
+		script.onload = onload;
+		script.onerror = scriptErr;
+		script.type = 'text/javascript';
+		script.src = src;
+		script.async = false;
+		document.body.appendChild(script);
+	}
 	function scriptLoad() {
 		remaining--;
 		if (remaining) {
@@ -51,18 +78,13 @@
 		} catch (e) {
 			console.error(e);
 			fail(ERR_SCRIPT);
+			return;
+		}
+		for (i = 0; i < CHUNKS.length; i++) {
+			addScript(CHUNKS[i], null);
 		}
-	}
-	function scriptErr() {
-		fail(ERR_SCRIPT);
 	}
 	for (i = 0; i < SCRIPTS.length; i++) {
-		var script = document.createElement('script');
-		script.onload = scriptLoad;
-		script.onerr = scriptErr;
-		script.type = 'text/javascript';
-		script.src = SCRIPTS[i];
-		script.async = false;
-		document.body.appendChild(script);
+		addScript(SCRIPTS[i], scriptLoad);
 	}
 })();
@@ -0,0 +1,88 @@
+/* Copyright 2016 Dietrich Epp.
+
+   This file is part of Kitten Teleporter.  The Kitten Teleporter source
+   code is distributed under the terms of the MIT license.
+   See LICENSE.txt for details. */
+/* jshint browser: true, worker: true, devel: true */
+
+// Service worker: caches the files in the build, so repeat visits do
+// not need the network.  The build fills in the manifest.
+(function() {
+	'use strict';
+
+	// Prefix for cache names, shared by all versions.
+	var CACHE_PREFIX = '';
+	// Cache name for this build, from the version and file hashes.
+	var CACHE_NAME = '';
+	// Files in the build, relative to this script.  All files except
+	// index.html have a content hash in their name.
+	var FILES = [];
+	// Files in the build which are not cached on install: image
+	// variants and asset packs other than the smallest.  Each client
+	// only uses one variant, so these are cached when they are fetched.
+	var OPTIONAL = [];
+
+	self.addEventListener('install', function(event) {
+		event.waitUntil(
+			caches.open(CACHE_NAME).then(function(cache) {
+				return cache.addAll(FILES);
+			}).then(function() {
+				return self.skipWaiting();
+			}));
+	});
+
+	self.addEventListener('activate', function(event) {
+		event.waitUntil(
+			caches.keys().then(function(names) {
+				return Promise.all(names.filter(function(name) {
+					return name.indexOf(CACHE_PREFIX) === 0 && name !== CACHE_NAME;
+				}).map(function(name) {
+					return caches.delete(name);
+				}));
+			}).then(function() {
+				return self.clients.claim();
+			}));
+	});
+
+	// Get the URL of a request without the query or fragment.
+	function pageURL(url) {
+		var u = new URL(url);
+		u.search = '';
+		u.hash = '';
+		return u.href;
+	}
+
+	self.addEventListener('fetch', function(event) {
+		var request = event.request;
+		if (request.method !== 'GET') {
+			return;
+		}
+		var scope = self.registration.scope;
+		var url = pageURL(request.url);
+		var key = request;
+		// The page is stored as index.html.  It refers to files in the
+		// same cache, so a cached page always gets matching files.  New
+		// builds are seen through the update of this script.
+		if (url === new URL('./', scope).href ||
+				url === new URL('index.html', scope).href) {
+			key = 'index.html';
+		}
+		event.respondWith(
+			caches.open(CACHE_NAME).then(function(cache) {
+				return cache.match(key).then(function(response) {
+					if (response) {
+						return response;
+					}
+					return fetch(request).then(function(response) {
+						var optional = OPTIONAL.some(function(path) {
+							return new URL(path, self.location).href === url;
+						});
+						if (optional && response.ok) {
+							cache.put(request, response.clone());
+						}
+						return response;
+					});
+				});
+			}));
+	});
+})();
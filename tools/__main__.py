@@ -4,21 +4,69 @@
 # code is distributed under the terms of the MIT license.
 # See LICENSE.txt for details.
 import argparse
-import yaml
-from . import app
-from . import build
+import os
 from . import config
 from . import slow
 
 def run():
     p = argparse.ArgumentParser()
     p.add_argument('action', choices=(
-        'build', 'serve', 'package', 'deploy'))
+        'build', 'serve', 'package', 'deploy', 'daemon', 'stage',
+        'combatsim'))
     p.add_argument('config', nargs='?')
     p.add_argument('--rate', type=slow.parse_rate)
+    p.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1,
+                   help='number of processes for stage and combatsim')
+    p.add_argument('-n', '--iterations', type=int, default=1000,
+                   help='number of combats for each pair, for combatsim')
+    p.add_argument('-o', '--output', metavar='PATH',
+                   help='write the combatsim table to PATH')
+    p.add_argument('--no-daemon', action='store_true',
+                   help='build in this process, even if a daemon is running')
+    p.add_argument('--trace', metavar='PATH',
+                   help='write a Chrome trace of the build to PATH')
     p.add_argument('-v', '--verbose', action='store_true')
     args = p.parse_args()
 
+    if args.action == 'daemon':
+        from . import daemon
+        daemon.serve()
+        return
+    if args.action == 'stage':
+        # Serve the existing build with a pool of processes.
+        from . import build
+        from . import prefork
+        try:
+            cfg = config.Config.load('serve', args.config)
+            prefork.serve(cfg, workers=args.workers, rate=args.rate)
+        except (config.ConfigError, build.BuildFailure) as ex:
+            print(ex)
+            raise SystemExit(1)
+        return
+    if args.action == 'combatsim':
+        # Simulate combat between each pair of shapes.  This uses the
+        # game code, not the configured build.
+        from . import build
+        from . import combatsim
+        if args.config is not None:
+            p.error('combatsim does not take a config')
+        if args.iterations <= 0 or args.workers <= 0:
+            p.error('iterations and workers must be positive')
+        try:
+            combatsim.run(args.iterations, jobs=args.workers,
+                          output=args.output)
+        except build.BuildFailure as ex:
+            print(ex)
+            raise SystemExit(1)
+        return
+    if args.action in ('build', 'package') and not (
+            args.no_daemon or args.trace):
+        from . import daemon
+        status = daemon.request(args.action, args.config,
+                                verbose=args.verbose)
+        if status is not None:
+            raise SystemExit(status)
+
     try:
         cfg = config.Config.load(args.action, args.config)
         if args.verbose:
@@ -26,7 +74,15 @@ def run():
     except config.ConfigError as ex:
         print(ex)
         raise SystemExit(1)
-    system = build.BuildSystem()
+    # Imported here so that errors in the command line or config are
+    # reported without waiting for the build system to load.
+    from . import app
+    from . import build
+    from . import store
+    from . import trace
+    if args.trace:
+        trace.enable()
+    system = build.BuildSystem(store=store.open_store(cfg.store))
     try:
         obj = app.App(cfg, system)
         obj.build()
@@ -34,17 +90,16 @@ def run():
             from . import serve
             serve.serve(cfg, obj, rate=args.rate)
         elif args.action == 'package':
-            version = system.version
-            assert version.startswith('v')
-            out_path = '{}-{}.tar.gz'.format(cfg.defs['name'], version[1:])
-            print('=' * 40)
-            print('Done building, creating {}...'.format(out_path))
-            system.package(out_path, 'build')
-            print('Created {}'.format(out_path))
+            obj.package()
         elif args.action == 'deploy':
             pass
     except build.BuildFailure as ex:
         print('Build failed: {}'.format(ex))
+        raise SystemExit(1)
+    finally:
+        if args.trace:
+            trace.save(args.trace)
+            trace.summary()
 
 if __name__ == '__main__':
     run()
@@ -4,15 +4,28 @@
 # code is distributed under the terms of the MIT license.
 # See LICENSE.txt for details.
 from . import build
+from . import genfont
 from . import shader
+from . import textlayout
 from . import version
-from mako import template
 import io
 import json
 import os
 import re
 import tempfile
 
+IMAGE_TYPES = {
+    'jpg': 'image/jpeg',
+    'png': 'image/png',
+    'webp': 'image/webp',
+}
+IMAGE_EXTS = {v: k for k, v in IMAGE_TYPES.items()}
+
+# Entry modules for feature chunks of the application, which are loaded
+# after the loading screen starts.  Each chunk registers its screens
+# with the state module when it runs.
+CHUNKS = ['game']
+
 class App(object):
     __slots__ = ['config', 'system']
 
@@ -20,8 +33,20 @@ class App(object):
         self.config = config
         self.system = system
 
+    def store_key(self):
+        """Get the configuration which builders depend on."""
+        return [self.config.config, self.config.debug, self.config.defs]
+
     def build(self):
-        """Build (or rebuild) the application."""
+        """Build (or rebuild) the application.
+
+        The build state is saved in build/cache, so a new process only
+        rebuilds files whose inputs changed.
+        """
+        state_path = 'build/cache/state-{}.pickle'.format(self.config.config)
+        state_key = [build.tools_hash(), self.store_key()]
+        if not self.system.cache:
+            self.system.load_state(state_path, state_key)
         ver = version.get_version('.')
         self.system.version = ver
         config = self.config.render(version=ver)
@@ -34,21 +59,79 @@ class App(object):
             self.shaders,
             args=(shaderinfo, shaders),
             deps=shaders + [shaderinfo])
+        shaders_js = self.system.build(
+            'build/shaders.js',
+            self.shaders_js,
+            args=(shaderinfo, shaders),
+            deps=shaders + [shaderinfo],
+            bust=True)
         del shaders, shaderinfo
 
+        # The font atlas is only packed again if the fonts or their
+        # character sets change.  The other font files are made from
+        # the packed atlas.
         assets = {}
-        with open('assets/images/fonts.json') as fp:
+        font_specs = genfont.load_spec(genfont.SPEC)
+        atlas = self.system.build(
+            'build/fonts/atlas.pickle',
+            self.font_atlas,
+            deps=[kw['path'] for kw in font_specs],
+            args=(font_specs, bool(self.config.defs.get('font_sdf'))),
+            intermediate=True)
+        del font_specs
+        font_image = self.system.build(
+            'build/fonts/fonts.png',
+            self.font_image,
+            deps=[atlas],
+            args=(atlas,),
+            intermediate=True)
+        fonts_json = self.system.build(
+            'build/fonts/fonts.json',
+            self.fonts_json,
+            deps=[atlas],
+            args=(atlas,),
+            intermediate=True)
+        text_deps = [atlas] + textlayout.spec_deps(textlayout.SPEC)
+        text_json = self.system.build(
+            'build/fonts/text.json',
+            self.text_json,
+            deps=text_deps,
+            args=(atlas,),
+            intermediate=True)
+        with open(fonts_json) as fp:
             assets['fonts'] = json.load(fp)
+        with open(text_json) as fp:
+            assets['text'] = json.load(fp)
         with open('assets/images/sprites.json') as fp:
             assets['sprites'] = json.load(fp)
-        self.build_images(assets, 'images', 'images')
+        self.build_images(
+            assets, 'images', 'images',
+            extra={'fonts': font_image},
+            grayscale={'fonts'})
+        font_data = self.system.build(
+            'build/fonts.bin',
+            self.font_data,
+            deps=text_deps,
+            args=(atlas,),
+            bust=True)
+        del text_deps
+        assets['fontData'] = (
+            self.inline('build/fonts.bin', font_data,
+                        'application/octet-stream') or
+            os.path.relpath(font_data, 'build'))
+        if self.config.defs.get('asset_pack'):
+            assets['packs'] = self.build_packs(assets)
 
-        # Top-level scripts.
-        scripts = [
+        # Top-level scripts.  The boot scripts show the loading screen,
+        # and the feature chunks are loaded while it runs.
+        boot_libs = [
             self.system.build_module(
                 'build/lodash.js',
                 'lodash-cli',
-                self.lodash_js),
+                self.lodash_js,
+                args=(build.lodash_usage('src'),)),
+        ]
+        chunk_libs = [
             self.system.build_module(
                 'build/howler.js',
                 'howler',
@@ -59,26 +142,75 @@ class App(object):
                 self.gl_matrix_js),
         ]
         if not self.config.debug:
-            self.system.mark_intermediate(scripts)
-            scripts = [self.system.build(
+            self.system.mark_intermediate(boot_libs + chunk_libs)
+            boot_libs = [self.system.build(
                 'build/lib.js',
                 self.lib_js,
-                args=(scripts,),
+                args=(boot_libs,),
                 bust=True)]
-        scripts.append(
-            self.system.build(
-                'build/app.js',
-                self.app_js,
-                args=(None if self.config.debug else config['js_header'],
-                      config['env']),
-                deps=list(build.all_files('src', exts={'.ts'})),
-                bust=True))
-        scripts.append(
+            chunk_libs = [self.system.build(
+                'build/lib-chunk.js',
+                self.lib_js,
+                args=(chunk_libs,),
+                bust=True)]
+        js_header = None if self.config.debug else config['js_header']
+        app_js = self.system.build(
+            'build/app.js',
+            self.app_js,
+            args=(js_header, config['env'], CHUNKS),
+            deps=list(build.all_files('src', exts={'.ts'})),
+            bust=True)
+        assets_js = self.system.build(
+            'build/assets.js',
+            self.assets_js,
+            args=(json.dumps(assets, indent=2, sort_keys=True),),
+            bust=True,
+            tools=['uglifyjs'])
+        scripts = boot_libs + [shaders_js, app_js, assets_js]
+        # Scripts which only contain data can be inlined in the page.
+        inline_scripts = []
+        for key, path in (('build/shaders.js', shaders_js),
+                          ('build/assets.js', assets_js)):
+            text = self.inline_script(key, path)
+            if text is not None:
+                inline_scripts.append(text)
+                scripts.remove(path)
+        chunks = chunk_libs + [
             self.system.build(
-                'build/assets.js',
-                self.assets_js,
-                args=(json.dumps(assets, indent=2, sort_keys=True),),
-                bust=True))
+                'build/{}.js'.format(name),
+                self.bundle_js,
+                args=('build/bundle/{}.js'.format(name), js_header),
+                deps=['build/bundle/{}.js'.format(name)],
+                bust=True,
+                tools=['uglifyjs'])
+            for name in CHUNKS]
+
+        # Hints so the browser can start downloading everything needed
+        # before the loader runs.  Feature chunks are only prefetched,
+        # so the boot scripts download first.
+        links = []
+        for path in scripts:
+            links.append({'rel': 'preload', 'as': 'script', 'href': path})
+        # Packs are not preloaded, since a fetch preload cannot be
+        # limited to browsers which support the pack's image type.  The
+        # loader picks a pack it supports.
+        if not assets.get('packs'):
+            if not assets['fontData'].startswith('data:'):
+                links.append({
+                    'rel': 'preload', 'as': 'fetch',
+                    'href': os.path.join('build', assets['fontData'])})
+            for name, variants in sorted(assets['images'].items()):
+                # Variants are sorted by size, and the type attribute
+                # lets browsers skip formats they do not support.
+                variant = variants[0]
+                if not variant['path'].startswith('data:'):
+                    links.append({
+                        'rel': 'preload', 'as': 'image',
+                        'type': variant['type'],
+                        'href': os.path.join(
+                            'build/images', variant['path'])})
+        for path in chunks:
+            links.append({'rel': 'prefetch', 'as': 'script', 'href': path})
 
         # Top-level index.html file.
         self.system.build(
@@ -89,35 +221,309 @@ class App(object):
                 'static/style.css',
                 'static/load.js',
             ],
-            args=(scripts, config))
+            args=(scripts, chunks, inline_scripts, links, config),
+            tools=['clean-css', 'html-minifier', 'uglifyjs'])
+
+        # Service worker for offline play, which caches everything else.
+        # Only the smallest variant of each image or pack is cached on
+        # install, since the others are usually not used.
+        if not self.config.debug:
+            optional = set()
+            for variants in assets['images'].values():
+                optional.update(
+                    'images/' + v['path'] for v in variants[1:]
+                    if not v['path'].startswith('data:'))
+            for pack in assets.get('packs', [])[1:]:
+                optional.add(pack['path'])
+            self.system.build(
+                'build/sw.js',
+                self.service_worker_js,
+                deps=['static/sw.js'],
+                args=(config['name'], config['version'],
+                      [f for f in self.system.manifest('build')
+                       if f[0] != 'sw.js'],
+                      sorted(optional)),
+                tools=['uglifyjs'])
+
+        self.system.save_state(state_path, state_key)
+
+    def package(self):
+        """Package the most recent build, and return the package path."""
+        version = self.system.version
+        assert version.startswith('v')
+        out_path = '{}-{}.tar.gz'.format(self.config.defs['name'], version[1:])
+        self.check_sizes()
+        print('=' * 40)
+        print('Done building, creating {}...'.format(out_path))
+        self.system.package(out_path, 'build')
+        print('Created {}'.format(out_path))
+        return out_path
+
+    def inline(self, key, path, content_type):
+        """Get a data URI for a built file, if it is small enough.
+
+        key: path the file was built as
+        path: path to the built file
+
+        Returns None if the file is too large.  Inlined files are not
+        packaged.
+        """
+        if os.path.getsize(path) > self.config.defs.get('inline_limit', 0):
+            return None
+        self.system.mark_intermediate([key])
+        return build.data_uri(path, content_type)
+
+    def inline_script(self, key, path):
+        """Get the contents of a built script, if it is small enough.
+
+        Returns None if the file is too large.  Inlined scripts are not
+        packaged.
+        """
+        if os.path.getsize(path) > self.config.defs.get('inline_limit', 0):
+            return None
+        self.system.mark_intermediate([key])
+        with open(path) as fp:
+            text = fp.read()
+        return text.replace('</', '<\\/')
+
+    def check_sizes(self):
+        """Report the size of the most recent build and check the budget."""
+        from . import sizes
+        version = self.system.version
+        report = sizes.Report.create(
+            version, 'build', self.system.files('build'), self.app_modules())
+        report.dump(previous=sizes.previous_report(version))
+        report.save()
+        errors = report.check_budget(self.config.budget)
+        if errors:
+            for error in errors:
+                print('Over budget: {}'.format(error))
+            raise build.BuildFailure('Size budget exceeded')
+
+    def app_modules(self):
+        """Get the code for each module in the application bundles.
+
+        Only modules reachable from the entry points are included, so
+        stale files in build/tsc are not counted.  The code is minified
+        the same way as the bundles, so the sizes show roughly how much
+        each module contributes.
+        """
+        import concurrent.futures
+        root = 'build/tsc'
+        paths = set()
+        for name in ['app'] + CHUNKS:
+            paths.update(build.module_deps(
+                os.path.join(root, name + '.js')))
+        def minify(path):
+            with open(path, 'rb') as fp:
+                data = fp.read()
+            return build.minify_js(self.config, data)
+        paths = sorted(paths)
+        with concurrent.futures.ThreadPoolExecutor(
+                os.cpu_count() or 1) as pool:
+            code = list(pool.map(minify, paths))
+        return {os.path.relpath(path, root): data
+                for path, data in zip(paths, code)}
+
+    def build_images(self, assets, dirname, keyname, *,
+                     extra={}, grayscale=()):
+        """Build images in a certain directory.
+
+        extra: map from names to paths of generated images to include
+        grayscale: names of images to reduce to grayscale
 
-    def build_images(self, assets, dirname, keyname):
-        """Build images in a certain directory."""
+        Each image is listed in the assets as an array of variants, with
+        the path, MIME type, and size in bytes of each variant.  The
+        variants are sorted from smallest to largest.  Small images are
+        inlined, and their path is a data URI.
+        """
         images = {}
         in_root = os.path.join('assets', dirname)
         out_root = os.path.join('build', dirname)
+        paths = {}
         for path in build.all_files(in_root, exts={'.png', '.jpg'}):
             relpath = os.path.relpath(path, in_root)
-            name = os.path.splitext(relpath)[0]
-            out_path = self.system.copy(
-                os.path.join(out_root, relpath),
-                path,
-                bust=True)
-            out_rel = os.path.relpath(out_path, out_root)
-            images[name] = out_rel
+            paths[os.path.splitext(relpath)[0]] = path
+        paths.update(extra)
+        # PNG files are optimized and converted to WebP in release
+        # builds.  JPEG files are copied as-is.
+        optimized = {}
+        if not self.config.debug:
+            from . import pngopt
+            optimized = pngopt.optimize_files(
+                [path for path in paths.values() if path.endswith('.png')],
+                cache='build/cache/images',
+                grayscale={paths[name] for name in grayscale},
+                formats=pngopt.FORMATS)
+        for name, path in sorted(paths.items()):
+            ext = os.path.splitext(path)[1]
+            sources = optimized.get(path) or {ext[1:]: path}
+            variants = []
+            for fmt, src in sorted(sources.items()):
+                key = os.path.join(out_root, name + '.' + fmt)
+                out_path = self.system.copy(key, src, bust=True)
+                ctype = IMAGE_TYPES[fmt]
+                variants.append({
+                    'path': (self.inline(key, out_path, ctype) or
+                             os.path.relpath(out_path, out_root)),
+                    'type': ctype,
+                    'size': os.path.getsize(out_path),
+                })
+            variants.sort(key=lambda v: v['size'])
+            images[name] = variants
         assets[keyname] = images
 
+    def build_packs(self, assets):
+        """Build asset packs, which contain images and font data.
+
+        There is one pack for each image type, so each client downloads
+        one pack with the smallest images it supports.  Packs contain
+        the files which were not inlined.  Returns a list of pack info,
+        sorted from smallest to largest.  Packed files are not packaged
+        separately.
+        """
+        types = sorted({variant['type']
+                        for variants in assets['images'].values()
+                        for variant in variants})
+        packs = []
+        packed = set()
+        for ptype in types:
+            files = []
+            for name, variants in sorted(assets['images'].items()):
+                # Use the variant with this type, or the smallest
+                # variant every browser supports.
+                for variant in variants:
+                    if variant['type'] == ptype:
+                        break
+                else:
+                    variant = next(
+                        v for v in variants
+                        if v['type'] in ('image/jpeg', 'image/png'))
+                if variant['path'].startswith('data:'):
+                    continue
+                ext = IMAGE_EXTS[variant['type']]
+                files.append((
+                    'images/' + name,
+                    'build/images/{}.{}'.format(name, ext),
+                    os.path.join('build/images', variant['path']),
+                    variant['type']))
+            if not assets['fontData'].startswith('data:'):
+                files.append((
+                    'fontData', 'build/fonts.bin',
+                    os.path.join('build', assets['fontData']),
+                    'application/octet-stream'))
+            if not files:
+                continue
+            entries = {}
+            offset = 0
+            for name, key, path, ctype in files:
+                size = os.path.getsize(path)
+                entries[name] = {
+                    'offset': offset, 'length': size, 'type': ctype}
+                offset += size
+                packed.add(key)
+            paths = [path for name, key, path, ctype in files]
+            pack_path = self.system.build(
+                'build/assets-{}.pack'.format(IMAGE_EXTS[ptype]),
+                self.pack_data,
+                args=(paths,),
+                deps=paths,
+                bust=True)
+            packs.append({
+                'path': os.path.relpath(pack_path, 'build'),
+                'imageType': ptype,
+                'size': offset,
+                'entries': entries,
+            })
+        self.system.mark_intermediate(sorted(packed))
+        packs.sort(key=lambda p: p['size'])
+        return packs
+
+    def pack_data(self, paths):
+        """Get the contents of an asset pack."""
+        data = []
+        for path in paths:
+            with open(path, 'rb') as fp:
+                data.append(fp.read())
+        return b''.join(data)
+
+    def font_atlas(self, specs, sdf):
+        """Render and pack the font atlas.
+
+        Returns a pickle of the PNG image data and the font metadata.
+
+        specs: font specification from genfont.load_spec
+        sdf: True to render the atlas as a signed distance field
+        """
+        from . import font
+        import pickle
+        atlas = genfont.render_atlas(
+            specs,
+            style=font.SDFStyle() if sdf else font.AlphaStyle(),
+            cache='build/fonts/cache')
+        return pickle.dumps(atlas, pickle.HIGHEST_PROTOCOL)
+
+    def _load_atlas(self, path):
+        """Load the packed font atlas, returning (png, fonts)."""
+        import pickle
+        with open(path, 'rb') as fp:
+            return pickle.load(fp)
+
+    def font_image(self, atlas):
+        """Get the font atlas image."""
+        return self._load_atlas(atlas)[0]
+
+    def fonts_json(self, atlas):
+        """Get the font metadata."""
+        from . import font
+        data, bdata = font.encode(self._load_atlas(atlas)[1])
+        return build.dump_json(self.config, data)
+
+    def _font_text(self, atlas):
+        """Get the binary font tables and the static text layouts.
+
+        Returns (bdata, text, tdata).  The text glyphs are stored after
+        the font tables.
+        """
+        from . import font
+        fonts = self._load_atlas(atlas)[1]
+        data, bdata = font.encode(fonts)
+        text, tdata = textlayout.bake(
+            textlayout.SPEC, fonts, offset=len(bdata))
+        return bdata, text, tdata
+
+    def text_json(self, atlas):
+        """Get the index of static text layouts."""
+        bdata, text, tdata = self._font_text(atlas)
+        return build.dump_json(self.config, text)
+
+    def font_data(self, atlas):
+        """Get the binary font tables and static text glyphs."""
+        bdata, text, tdata = self._font_text(atlas)
+        return bdata + tdata
+
     def shaders(self, info_path, paths):
         """Get the contents of the shader module."""
-        return (shader.process_all(self.config, info_path, paths)
+        return (shader.process_all(self.config, info_path, paths).code
                 .encode('UTF-8'))
 
-    def lodash_js(self):
-        """Get the contents of the lodash.js package."""
+    def shaders_js(self, info_path, paths):
+        """Get the contents of the shader sources script."""
+        sources = shader.process_all(self.config, info_path, paths).sources
+        return (b'window.ShaderSources = ' +
+                build.dump_json(self.config, sources) + b';\n')
+
+    def lodash_js(self, functions):
+        """Get the contents of the lodash.js package.
+
+        functions: list of lodash functions to include, or None to
+        include all functions
+        """
+        cmd = ['./node_modules/.bin/lodash', 'strict']
+        if functions:
+            cmd.append('include=' + ','.join(functions))
         with tempfile.TemporaryDirectory() as path:
-            build.run_pipe(
-                ['./node_modules/.bin/lodash',
-                 'strict', '-o', os.path.join(path, 'lodash.js')])
+            build.run_pipe(cmd + ['-o', os.path.join(path, 'lodash.js')])
             with open(os.path.join(path, 'lodash.min.js'), 'rb') as fp:
                 data = fp.read()
         data = re.sub(rb' *-o /.*\.js', b'', data, count=1)
@@ -146,16 +552,33 @@ class App(object):
             fp.write(b'\n')
         return fp.getvalue()
 
-    def app_js(self, js_header, env):
-        """Get the contents of the main application JavaScript code."""
-        appjs = './build/app.js'
+    def app_js(self, js_header, env, chunks):
+        """Get the contents of the main application JavaScript code.
+
+        This is the boot chunk, which contains the loading screen and
+        the modules it uses.  Feature chunks are written to build/bundle,
+        and share the modules in the boot chunk.
+        """
         build.compile_ts(self.config, 'src/tsconfig.json')
+        os.makedirs('build/bundle', exist_ok=True)
+        entry = 'build/tsc/app.js'
+        boot = build.module_deps(entry)
         build.browserify(
-            self.config, './build/app.js', ['./build/tsc/app.js'], env)
-        with open('./build/app.js', 'rb') as fp:
+            self.config, 'build/bundle/app.js', [entry], env,
+            require=boot - {entry})
+        for name in chunks:
+            build.browserify(
+                self.config, 'build/bundle/{}.js'.format(name),
+                ['build/tsc/{}.js'.format(name)], env,
+                external=boot)
+        return self.bundle_js('build/bundle/app.js', js_header)
+
+    def bundle_js(self, path, js_header):
+        """Get the minified contents of a JavaScript bundle."""
+        with open(path, 'rb') as fp:
             data = fp.read()
         data = build.minify_js(self.config, data)
-        if not self.config.debug:
+        if js_header is not None:
             fp = io.StringIO()
             fp.write('/*\n')
             for line in js_header.splitlines():
@@ -170,36 +593,72 @@ class App(object):
             self.config,
             'window.AssetInfo = {}\n'.format(assets).encode('UTF-8'))
 
+    def service_worker_js(self, name, version, manifest, optional):
+        """Get the service worker code.
+
+        manifest: list of (path, hash) for each file to cache
+        optional: paths in the manifest to cache only when fetched
+        """
+        import hashlib
+        with open('static/sw.js') as fp:
+            data = fp.read()
+        obj = hashlib.sha256()
+        obj.update(json.dumps(manifest).encode('UTF-8'))
+        prefix = name + '-'
+        values = {
+            'CACHE_PREFIX': prefix,
+            'CACHE_NAME': '{}{}-{}'.format(
+                prefix, version, obj.hexdigest()[:8]),
+            'FILES': [path for path, fhash in manifest
+                      if path not in optional],
+            'OPTIONAL': optional,
+        }
+        for key, value in sorted(values.items()):
+            empty = "''" if isinstance(value, str) else '[]'
+            data = data.replace(
+                'var {} = {};'.format(key, empty),
+                'var {} = {};'.format(
+                    key, json.dumps(value, separators=(',', ':'))))
+        return build.minify_js(self.config, data.encode('UTF-8'))
+
     def index_css(self):
         """Get the main CSS styles."""
         with open('static/style.css', 'rb') as fp:
             data = fp.read()
         return build.minify_css(self.config, data).decode('UTF-8')
 
-    def index_js(self, scripts):
+    def index_js(self, scripts, chunks):
         """Get the JavaScript loader code."""
         with open('static/load.js') as fp:
             data = fp.read()
-        scripts = [os.path.relpath(path, 'build/') for path in scripts]
+        for name, paths in (('SCRIPTS', scripts), ('CHUNKS', chunks)):
+            paths = [os.path.relpath(path, 'build/') for path in paths]
+            data = data.replace(
+                'var {} = [];'.format(name),
+                'var {} = {};'.format(
+                    name, json.dumps(paths, separators=(',', ':'))))
+        if not self.config.debug:
+            data = data.replace(
+                'var SERVICE_WORKER = null;',
+                "var SERVICE_WORKER = 'sw.js';")
         return build.minify_js(
-            self.config,
-            data.replace(
-                'var SCRIPTS = [];',
-                'var SCRIPTS = {};'.format(
-                    json.dumps(scripts, separators=(',', ':'))))
-            .encode('UTF-8')).decode('UTF-8')
+            self.config, data.encode('UTF-8')).decode('UTF-8')
 
-    def index_html(self, scripts, config):
+    def index_html(self, scripts, chunks, inline_scripts, links, config):
         """Get the main HTML page."""
+        from . import tmplcache
         def relpath(path):
             return os.path.relpath(path, 'build/')
-        tmpl = template.Template(filename='static/index.mak')
+        tmpl = tmplcache.from_file(
+            'static/index.mak', module_directory='build/mako')
         cxt = dict(config)
         cxt.update(
             relpath=relpath,
             scripts=scripts,
+            inline_scripts=inline_scripts,
+            links=[dict(link, href=relpath(link['href'])) for link in links],
             css_data=self.index_css(),
-            js_data=self.index_js(scripts),
+            js_data=self.index_js(scripts, chunks),
         )
         data = tmpl.render(**cxt)
         return build.minify_html(self.config, data.encode('UTF-8'))
@@ -0,0 +1,311 @@
+# Copyright 2016 Dietrich Epp.
+#
+# This file is part of Kitten Teleporter.  The Kitten Teleporter source
+# code is distributed under the terms of the MIT license.
+# See LICENSE.txt for details.
+"""Benchmarks for the build tools.
+
+Run with 'python -m tools.bench'.  Results can be saved as JSON with
+--save, and compared against saved results with --compare, which fails
+if any benchmark is slower than the baseline by more than the
+threshold.
+"""
+import argparse
+import collections
+import contextlib
+import http.client
+import itertools
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+Result = collections.namedtuple('Result', 'min median repeat')
+
+# Stand-in for config.Config, with the fields the tools use.
+_Config = collections.namedtuple('_Config', 'debug')
+
+BENCHMARKS = []
+
+def benchmark(name, *, repeat=5):
+    """Decorator to register a benchmark.
+
+    The function is called once to set up, and returns a function to
+    time, or None if the benchmark cannot run.
+    """
+    def decorator(func):
+        BENCHMARKS.append((name, func, repeat))
+        return func
+    return decorator
+
+# Temporary directories to remove when benchmarks finish.
+_tempdirs = []
+
+def _mkdtemp():
+    path = tempfile.mkdtemp()
+    _tempdirs.append(path)
+    return path
+
+########################################################################
+# Rectangle packing
+
+_DISTRIBUTIONS = {
+    'uniform': lambda r: (r.randint(1, 50), r.randint(1, 50)),
+    'square': lambda r: (lambda x: (x, x))(r.randint(1, 50)),
+    'glyph': lambda r: (r.randint(4, 40), r.randint(30, 50)),
+    'thin': lambda r: (r.randint(1, 8), r.randint(20, 100)),
+}
+
+def _register_rectpack():
+    from . import rectpack
+    # The default skyline method has no method name in the benchmark.
+    methods = [('', {})] + [
+        (name + '.', {'method': name, 'rotate': True})
+        for name in ('best', 'guillotine', 'maxrects')]
+    for count in (100, 1000):
+        for dname, dist in sorted(_DISTRIBUTIONS.items()):
+            for mname, kw in methods:
+                def setup(count=count, dist=dist, kw=kw):
+                    r = random.Random(count)
+                    rects = [dist(r) for i in range(count)]
+                    return lambda: rectpack.pack(rects, **kw)
+                benchmark('rectpack.{}{}.{}'.format(mname, dname, count))(
+                    setup)
+_register_rectpack()
+
+########################################################################
+# Shaders
+
+@benchmark('shader.process_all.50')
+def bench_shader(count=50):
+    from . import shader
+    tmp = _mkdtemp()
+    info = {}
+    paths = []
+    for i in range(count):
+        name = 'Prog{}'.format(i)
+        for stype in ('vert', 'frag'):
+            path = os.path.join(tmp, 'prog{}.{}'.format(i, stype))
+            paths.append(path)
+            with open(path, 'w') as fp:
+                fp.write(
+                    '// Program {}\n'
+                    'attribute vec4 Pos;\n'
+                    'uniform mat4 MVP;\n'
+                    'uniform vec4 Color[4];\n'
+                    'varying vec2 vTexCoord;\n'
+                    '\n'
+                    'void main() {{\n'
+                    '    vec4 position = MVP * Pos;\n'
+                    '    vTexCoord = position.xy;\n'
+                    '    gl_Position = position;\n'
+                    '}}\n'.format(i))
+        info[name] = {
+            'vert': 'prog{}'.format(i),
+            'frag': 'prog{}'.format(i),
+            'attributes': 'Pos',
+        }
+    info_path = os.path.join(tmp, 'info.yaml')
+    with open(info_path, 'w') as fp:
+        json.dump(info, fp)
+    config = _Config(debug=False)
+    return lambda: shader.process_all(config, info_path, paths)
+
+########################################################################
+# Fonts
+
+@benchmark('font.FontSet', repeat=3)
+def bench_font():
+    try:
+        import freetype, numpy, PIL
+    except ImportError:
+        return None
+    from . import font
+    fdir = os.path.join(ROOT, 'assets', 'fonts')
+    tmp = _mkdtemp()
+    def run():
+        s = font.FontSet()
+        s.add(size=64, margin=4,
+              path=os.path.join(fdir, 'almendra/Almendra-Regular.ttf'))
+        s.add(size=32, margin=2,
+              path=os.path.join(fdir, 'patrickhand/PatrickHand-Regular.ttf'))
+        s.save(image_path=os.path.join(tmp, 'fonts.png'),
+               json_path=os.path.join(tmp, 'fonts.json'))
+    return run
+
+########################################################################
+# Build system
+
+def _build_setup(ndeps):
+    tmp = _mkdtemp()
+    deps = []
+    for i in range(ndeps):
+        path = os.path.join(tmp, 'dep{}.txt'.format(i))
+        with open(path, 'w') as fp:
+            fp.write(str(i))
+        deps.append(path)
+    return tmp, deps
+
+@benchmark('build.noop.1000')
+def bench_build_noop():
+    from . import build
+    tmp, deps = _build_setup(1000)
+    system = build.BuildSystem()
+    out = os.path.join(tmp, 'out.bin')
+    data = bytes(1024 * 64)
+    system.build(out, lambda: data, deps=deps)
+    return lambda: system.build(out, lambda: data, deps=deps)
+
+@benchmark('build.rebuild.1000')
+def bench_build_rebuild():
+    from . import build
+    tmp, deps = _build_setup(1000)
+    out = os.path.join(tmp, 'out.bin')
+    data = bytes(1024 * 64)
+    # The contents change each time, since unchanged files are not
+    # written.
+    counter = itertools.count()
+    def run():
+        system = build.BuildSystem()
+        system.build(
+            out, lambda: next(counter).to_bytes(8, 'little') + data,
+            deps=deps)
+    return run
+
+########################################################################
+# Server
+
+@benchmark('serve.Handler.200', repeat=3)
+def bench_serve(count=200):
+    from . import serve
+    from wsgiref.simple_server import make_server, WSGIRequestHandler
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, *args):
+            pass
+    tmp = _mkdtemp()
+    os.makedirs(os.path.join(tmp, 'build'))
+    with open(os.path.join(tmp, 'build', 'app.js'), 'wb') as fp:
+        fp.write(bytes(1024 * 256))
+    handler = serve.Handler(None)
+    def run():
+        # The handler opens files relative to the working directory.
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        server = make_server('127.0.0.1', 0, handler, serve.ThreadingServer,
+                             handler_class=QuietHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            for i in range(count):
+                conn = http.client.HTTPConnection(
+                    '127.0.0.1', server.server_port)
+                conn.request('GET', '/app.js')
+                resp = conn.getresponse()
+                resp.read()
+                assert resp.status == 200
+                conn.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+            os.chdir(cwd)
+    return run
+
+########################################################################
+# Startup
+
+@benchmark('startup.import', repeat=1)
+def bench_startup():
+    from . import startup
+    def run():
+        times = startup.import_times('tools.__main__', cwd=ROOT)
+        return sum(t.self for t in times) * 1e-6
+    return run
+
+########################################################################
+
+@contextlib.contextmanager
+def _quiet():
+    """Discard output from the code being benchmarked."""
+    with open(os.devnull, 'w') as fp:
+        with contextlib.redirect_stdout(fp), contextlib.redirect_stderr(fp):
+            yield
+
+def run_benchmarks(pattern=None):
+    """Run all benchmarks, and return a map from name to Result."""
+    results = {}
+    try:
+        for name, setup, repeat in BENCHMARKS:
+            if pattern is not None and pattern not in name:
+                continue
+            with _quiet():
+                func = setup()
+            if func is None:
+                print('{:30} skipped'.format(name))
+                continue
+            times = []
+            for i in range(repeat):
+                with _quiet():
+                    t0 = time.perf_counter()
+                    value = func()
+                    t1 = time.perf_counter()
+                # Benchmarks which time themselves return the time.
+                times.append(value if isinstance(value, float) else t1 - t0)
+            times.sort()
+            r = Result(times[0], times[len(times) // 2], repeat)
+            print('{:30} {:9.2f}ms  (median {:.2f}ms)'
+                  .format(name, r.min * 1e3, r.median * 1e3))
+            results[name] = r
+    finally:
+        for path in _tempdirs:
+            shutil.rmtree(path, ignore_errors=True)
+        del _tempdirs[:]
+    return results
+
+def compare(results, baseline, threshold):
+    """Compare results against a baseline, and return regressions."""
+    regressions = []
+    print('Comparison with baseline:')
+    for name, r in sorted(results.items()):
+        try:
+            b = Result(**baseline[name])
+        except KeyError:
+            print('{:30} new'.format(name))
+            continue
+        ratio = r.min / b.min if b.min > 0 else 1.0
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print('{:30} {:+7.1f}%{}'.format(name, (ratio - 1) * 100, flag))
+    return regressions
+
+def main():
+    p = argparse.ArgumentParser(prog='python -m tools.bench')
+    p.add_argument('pattern', nargs='?',
+                   help='only run benchmarks containing this string')
+    p.add_argument('--save', metavar='PATH', help='save results as JSON')
+    p.add_argument('--compare', metavar='PATH',
+                   help='compare results against saved baseline')
+    p.add_argument('--threshold', type=float, default=0.1,
+                   help='relative slowdown reported as a regression')
+    args = p.parse_args()
+    results = run_benchmarks(args.pattern)
+    if args.save:
+        with open(args.save, 'w') as fp:
+            json.dump({name: r._asdict() for name, r in results.items()},
+                      fp, indent=2, sort_keys=True)
+        print('Saved results to {}'.format(args.save))
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)
+        if compare(results, baseline, args.threshold):
+            raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
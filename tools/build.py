@@ -9,8 +9,11 @@ import hashlib
 import json
 import os
 import pipes
+import re
 import subprocess
 import sys
+from . import store
+from . import trace
 
 class BuildFailure(Exception):
     pass
@@ -37,6 +40,24 @@ def all_files(root, *, exts=None):
                     continue
             yield os.path.join(dirpath, filename)
 
+LODASH_REF = re.compile(r'\b_(?:\.([A-Za-z_$][\w$]*)|\s*\()')
+
+def lodash_usage(root):
+    """Find the lodash functions used by TypeScript code below a root.
+
+    Returns a sorted list of function names, or None if the lodash
+    wrapper _() is used, which requires a full build.
+    """
+    names = set()
+    for path in all_files(root, exts={'.ts'}):
+        with open(path) as fp:
+            text = fp.read()
+        for m in LODASH_REF.finditer(text):
+            if m.group(1) is None:
+                return None
+            names.add(m.group(1))
+    return sorted(names)
+
 def latest_mtime(files):
     """Get the latest modification timestamp of the given files."""
     mtime = -1
@@ -44,6 +65,16 @@ def latest_mtime(files):
         mtime = max(mtime, os.stat(file).st_mtime)
     return mtime
 
+def file_hash(path):
+    """Get the SHA-256 hash of a file, or None if it does not exist."""
+    obj = hashlib.new('SHA256')
+    try:
+        with open(path, 'rb') as fp:
+            obj.update(fp.read())
+    except FileNotFoundError:
+        return None
+    return obj.digest()
+
 def format_cmd(cmd, *, cwd=None):
     parts = []
     if cwd is not None:
@@ -56,30 +87,80 @@ def format_cmd(cmd, *, cwd=None):
 def run_cmd(cmd, *, cwd=None):
     """Run a simple command."""
     print('    ' + format_cmd(cmd, cwd=cwd), file=sys.stderr)
-    proc = subprocess.Popen(cmd, cwd=cwd)
-    proc.wait()
+    with trace.command(cmd):
+        proc = subprocess.Popen(cmd, cwd=cwd)
+        proc.wait()
     if proc.returncode != 0:
         raise BuildFailure('Command failed: {}'.format(cmd[0]))
 
 def run_pipe(cmd, data=None, *, cwd=None):
     """Pipe data through a single command."""
     print('    ' + format_cmd(cmd, cwd=cwd), file=sys.stderr)
-    proc = subprocess.Popen(
-        cmd,
-        stdin=None if data is None else subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        cwd=None)
-    stdout, stderr = proc.communicate(data)
+    with trace.command(cmd):
+        proc = subprocess.Popen(
+            cmd,
+            stdin=None if data is None else subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            cwd=None)
+        stdout, stderr = proc.communicate(data)
     if proc.returncode != 0:
         raise BuildFailure('Command failed: {}'.format(cmd[0]))
     return stdout
 
+def module_version(name):
+    """Get the version of an installed NPM module."""
+    with open(os.path.join('node_modules', name, 'package.json')) as fp:
+        return json.load(fp)['version']
+
+# Hash of the build tools, computed once per process.
+_tools_hash = None
+
+def tools_hash():
+    """Get a hash of every module in the build tools.
+
+    Builders call helper modules which are imported lazily, so the
+    whole package is hashed, rather than the modules in use.
+    """
+    global _tools_hash
+    if _tools_hash is None:
+        root = os.path.dirname(os.path.abspath(__file__))
+        obj = hashlib.new('SHA256')
+        for name in sorted(os.listdir(root)):
+            if not name.endswith('.py'):
+                continue
+            obj.update(name.encode('UTF-8') + b'\0')
+            obj.update(file_hash(os.path.join(root, name)))
+        _tools_hash = base64.b16encode(obj.digest()).decode('ASCII')
+    return _tools_hash
+
+def builder_id(builder):
+    """Get the identity of a builder, for the store key.
+
+    This includes a hash of the build tools, so stored files are not
+    reused after the build tools change.  Builders which are methods
+    also include the store_key() of their object.
+    """
+    func = getattr(builder, '__func__', builder)
+    ident = [func.__module__, func.__qualname__, tools_hash()]
+    obj = getattr(builder, '__self__', None)
+    if obj is not None:
+        ident.append(obj.store_key())
+    return ident
+
 CachedFile = collections.namedtuple('CachedFile', 'path fhash key intermediate')
 
 def sort_key(path):
     base, ext = os.path.splitext(path)
     return ext, base
 
+def _stat_key(path):
+    """Get the size and mtime of a file, or None if it does not exist."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
 class BuildSystem(object):
     """The application build system."""
     __slots__ = [
@@ -87,11 +168,76 @@ class BuildSystem(object):
         'cache',
         # Version of most recent build.
         'version',
+        # Shared store for build outputs, or None.
+        'store',
+        # Map of build files from the state of a previous process, to
+        # (CachedFile, stat key of the output).
+        'saved',
     ]
 
-    def __init__(self):
+    def __init__(self, *, store=None):
         self.cache = {}
         self.version = None
+        self.store = store
+        self.saved = {}
+
+    def load_state(self, path, key):
+        """Load the build state saved by a previous process.
+
+        key: identity of the configuration and tools, which must match
+        the key the state was saved with
+        """
+        import pickle
+        try:
+            with open(path, 'rb') as fp:
+                skey, saved = pickle.load(fp)
+        except FileNotFoundError:
+            return
+        except Exception as ex:
+            print('Ignoring build state {}: {}'.format(path, ex),
+                  file=sys.stderr)
+            return
+        if skey == key:
+            self.saved = saved
+
+    def save_state(self, path, key):
+        """Save the build state, so another process can reuse it."""
+        import pickle
+        import tempfile
+        saved = {}
+        for name, cached in self.cache.items():
+            if cached.key is not None:
+                saved[name] = cached, _stat_key(cached.path)
+        dirname = os.path.dirname(path) or '.'
+        os.makedirs(dirname, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                pickle.dump((key, saved), fp, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def _lookup(self, path, intermediate):
+        """Get the cached info for a build file, or None."""
+        try:
+            return self.cache[path]
+        except KeyError:
+            pass
+        try:
+            cached, stat = self.saved.pop(path)
+        except KeyError:
+            return None
+        # Outputs changed since the state was saved are rebuilt.
+        if stat is None or _stat_key(cached.path) != stat:
+            return None
+        cached = cached._replace(intermediate=intermediate)
+        self.cache[path] = cached
+        return cached
 
     def copy(self, path, src, *, bust=False):
         """Copy a file and return the path."""
@@ -105,51 +251,98 @@ class BuildSystem(object):
         return self.build(path, lambda x: x, args=[data], bust=bust)
 
     def build(self, path, builder, *,
-              deps=[], args=(), kw={}, bust=False, intermediate=False):
-        """Build a file and return the corrected path."""
-        mtime = latest_mtime(deps)
-        key = mtime, args, kw
-        try:
-            cached = self.cache[path]
-        except KeyError:
-            cached = None
-        else:
-            if key == cached.key:
+              deps=[], args=(), kw={}, bust=False, intermediate=False,
+              tools=None):
+        """Build a file and return the corrected path.
+
+        tools: names of the NPM modules the builder runs.  If this is
+        given, the output must only depend on the builder, the contents
+        of the dependencies, and the arguments, which must be JSON, and
+        the output is shared through the store.
+        """
+        with trace.span('build', path=path) as targs:
+            with trace.span('stat', path=path):
+                mtime = latest_mtime(deps)
+            key = mtime, args, kw
+            cached = self._lookup(path, intermediate)
+            if cached is not None and key == cached.key:
+                targs['cache'] = 'hit'
                 return cached.path
-        print('Rebuilding {}'.format(path), file=sys.stderr)
-        data = builder(*args, **kw)
-        obj = hashlib.new('SHA256')
-        obj.update(data)
-        fhash = obj.digest()
-        if cached is not None and cached.fhash == fhash:
-            return cached.path
-        dirname, basename = os.path.split(path)
-        if bust:
-            out_name = '{0[0]}.{1}{0[1]}'.format(
-                os.path.splitext(basename),
-                base64.b16encode(fhash)[:8].lower().decode('UTF-8'))
-            out_path = os.path.join(dirname, out_name)
-        else:
-            out_path = path
-        cached = CachedFile(out_path, fhash, key, intermediate)
-        if dirname:
-            os.makedirs(dirname, exist_ok=True)
-        with open(out_path, 'wb') as fp:
-            fp.write(data)
-        self.cache[path] = cached
-        return out_path
+            targs['cache'] = 'miss'
+            data = None
+            if tools is not None and self.store is not None:
+                with trace.span('store', path=path):
+                    skey = store.key(
+                        builder_id(builder),
+                        [base64.b16encode(file_hash(dep)).decode('ASCII')
+                         for dep in deps],
+                        args, kw,
+                        {name: module_version(name) for name in tools})
+                    data = self.store.get(skey)
+                if data is not None:
+                    targs['cache'] = 'store'
+                    print('Restored {} from store'.format(path),
+                          file=sys.stderr)
+            else:
+                skey = None
+            if data is None:
+                print('Rebuilding {}'.format(path), file=sys.stderr)
+                with trace.span('builder', path=path):
+                    data = builder(*args, **kw)
+                if skey is not None:
+                    self.store.put(skey, data)
+            with trace.span('hash', path=path):
+                obj = hashlib.new('SHA256')
+                obj.update(data)
+                fhash = obj.digest()
+            if cached is not None and cached.fhash == fhash:
+                targs['cache'] = 'unchanged'
+                self.cache[path] = cached._replace(
+                    key=key, intermediate=intermediate)
+                return cached.path
+            dirname, basename = os.path.split(path)
+            if bust:
+                out_name = '{0[0]}.{1}{0[1]}'.format(
+                    os.path.splitext(basename),
+                    base64.b16encode(fhash)[:8].lower().decode('UTF-8'))
+                out_path = os.path.join(dirname, out_name)
+            else:
+                out_path = path
+            cached = CachedFile(out_path, fhash, key, intermediate)
+            # Leave the file alone if it has the same contents, so
+            # targets which depend on its mtime are not rebuilt.
+            if file_hash(out_path) == fhash:
+                targs['cache'] = 'unchanged'
+                self.cache[path] = cached
+                return out_path
+            with trace.span('write', path=path, bytes=len(data)):
+                if dirname:
+                    os.makedirs(dirname, exist_ok=True)
+                with open(out_path, 'wb') as fp:
+                    fp.write(data)
+            targs['bytes'] = len(data)
+            self.cache[path] = cached
+            return out_path
 
-    def build_module(self, path, name, builder, *, intermediate=False):
-        """Build a file from an NPM module."""
-        with open(os.path.join('node_modules', name, 'package.json')) as fp:
-            data = json.load(fp)
-        version = data['version']
+    def build_module(self, path, name, builder, *,
+                     args=(), intermediate=False):
+        """Build a file from an NPM module.
+
+        The output is named after the module version, and a hash of the
+        builder arguments if there are any, and is only built if it
+        does not exist.
+        """
+        version = module_version(name)
+        if args:
+            obj = hashlib.new('SHA256')
+            obj.update(json.dumps(args, sort_keys=True).encode('UTF-8'))
+            version += '-' + obj.hexdigest()[:8]
         dirname, basename = os.path.split(path)
         out_name = '{0[0]}-{1}{0[1]}'.format(
             os.path.splitext(basename), version)
         out_path = os.path.join(dirname, out_name)
         if not os.path.isfile(out_path):
-            data = builder()
+            data = builder(*args)
             if dirname:
                 os.makedirs(dirname, exist_ok=True)
             with open(out_path, 'wb') as fp:
@@ -167,6 +360,24 @@ class BuildSystem(object):
                 files.append(c.path[len(root):])
         return files
 
+    def manifest(self, root):
+        """Get the contents hash of each file below the given root.
+
+        Returns a sorted list of (path, hash) pairs, with paths
+        relative to the root and hashes in hexadecimal.
+        """
+        if root and not root.endswith('/'):
+            root += '/'
+        manifest = []
+        for c in self.cache.values():
+            if not c.intermediate and c.path.startswith(root):
+                fhash = c.fhash or file_hash(c.path)
+                manifest.append((
+                    c.path[len(root):],
+                    base64.b16encode(fhash).lower().decode('ASCII')))
+        manifest.sort()
+        return manifest
+
     def package(self, out_path, root):
         """Create a package for all of the files below the given root"""
         files = self.files(root)
@@ -193,8 +404,37 @@ def compile_ts(config, tsconfig):
     cmd = [nbin('tsc'), '-p', tsconfig]
     run_cmd(cmd)
 
-def browserify(config, output, modules, env):
-    """Bundle a JavaScript application using browserify."""
+REQUIRE = re.compile(r'''\brequire\(\s*(['"])(\.{1,2}/[^'"]*)\1\s*\)''')
+
+def module_deps(path):
+    """Get the local modules a CommonJS module depends on.
+
+    Returns the set of paths of all modules reachable from the given
+    module through relative require() calls, including the module.
+    """
+    result = set()
+    todo = [os.path.normpath(path)]
+    while todo:
+        path = todo.pop()
+        if path in result:
+            continue
+        result.add(path)
+        with open(path) as fp:
+            text = fp.read()
+        for m in REQUIRE.finditer(text):
+            dep = os.path.normpath(
+                os.path.join(os.path.dirname(path), m.group(2)))
+            if not dep.endswith('.js'):
+                dep += '.js'
+            todo.append(dep)
+    return result
+
+def browserify(config, output, modules, env, *, require=(), external=()):
+    """Bundle a JavaScript application using browserify.
+
+    require: modules to expose to other bundles
+    external: modules to load from another bundle
+    """
     dirname, outname = os.path.split(output)
     dirname = dirname or '.'
     cmd = [
@@ -208,6 +448,12 @@ def browserify(config, output, modules, env):
         for key, value in env.items():
             cmd.extend(('--' + key.upper(), value))
         cmd.append(']')
+    for flag, paths in (('-r', require), ('-x', external)):
+        for path in sorted(paths):
+            path = os.path.relpath(path, dirname)
+            if not path.startswith('.'):
+                path = './' + path
+            cmd.extend((flag, path))
     cmd.extend(os.path.relpath(module, dirname) for module in modules)
     run_cmd(cmd, cwd=dirname)
     if config.debug:
@@ -255,6 +501,13 @@ def minify_json(config, path):
     obj = json.dumps(obj, separators=(',', ':'), sort_keys=True)
     return obj.encode('UTF-8')
 
+def data_uri(path, content_type):
+    """Get a data URI with the contents of a file."""
+    with open(path, 'rb') as fp:
+        data = fp.read()
+    return 'data:{};base64,{}'.format(
+        content_type, base64.b64encode(data).decode('ASCII'))
+
 def dump_json(config, obj, *, pretty=False):
     """Dump JSON in the configured format.
 
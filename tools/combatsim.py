@@ -0,0 +1,155 @@
+# Copyright 2016 Dietrich Epp.
+#
+# This file is part of Kitten Teleporter.  The Kitten Teleporter source
+# code is distributed under the terms of the MIT license.
+# See LICENSE.txt for details.
+"""Parallel combat simulation runner.
+
+The table of matchups from scripts/combatsim.js is split into shards,
+and each shard is run by a separate Node process.  Results are cached
+for each pair of shapes by a hash of the compiled game code, so after
+an interrupted run only the remaining pairs are simulated.
+"""
+import argparse
+import concurrent.futures
+import glob
+import hashlib
+import json
+import os
+import sys
+from . import build
+
+SCRIPT = 'scripts/combatsim.js'
+GAME_JS = 'build/tsc/game/*.js'
+CACHE_DIR = 'build/cache/combatsim'
+
+# Change this to invalidate cached results.
+_CACHE_VERSION = 1
+
+def code_hash():
+    """Get the hash of the compiled game code and the simulation script."""
+    paths = sorted(glob.glob(GAME_JS))
+    if not paths:
+        raise build.BuildFailure(
+            'No compiled game code, run tsc first: {}'.format(GAME_JS))
+    obj = hashlib.sha256()
+    for path in paths + [SCRIPT]:
+        obj.update(path.encode('UTF-8') + b'\0')
+        with open(path, 'rb') as fp:
+            data = fp.read()
+        obj.update('{}\0'.format(len(data)).encode('ASCII'))
+        obj.update(data)
+    return obj.hexdigest()
+
+def node_json(args, data=None):
+    """Run the simulation script and parse its JSON output."""
+    return json.loads(build.run_pipe(
+        ['node', SCRIPT] + args, data).decode('UTF-8'))
+
+class ResultCache(object):
+    """Cache of simulation results for one version of the game code."""
+    __slots__ = ['path', 'results']
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path) as fp:
+                self.results = json.load(fp)
+        except FileNotFoundError:
+            self.results = {}
+
+    @staticmethod
+    def key(pair, itercount):
+        return '{},{}:{}'.format(pair[0], pair[1], itercount)
+
+    def get(self, pair, itercount):
+        return self.results.get(self.key(pair, itercount))
+
+    def add(self, result, itercount):
+        pair = result['shape1'], result['shape2']
+        self.results[self.key(pair, itercount)] = result
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as fp:
+            json.dump(self.results, fp, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+def run_shard(pairs, itercount):
+    """Simulate a list of pairs in one Node process."""
+    return node_json(
+        ['match', str(itercount)] + ['{},{}'.format(*p) for p in pairs])
+
+def shard(items, count):
+    """Split a list into at most count shards of similar size."""
+    return [items[i::count] for i in range(count) if items[i::count]]
+
+def run_table(itercount, *, jobs):
+    """Simulate every pair of shapes, and return the results in order."""
+    info = node_json(['pairs'])
+    pairs = [tuple(p) for p in info['pairs']]
+    obj = hashlib.sha256(code_hash().encode('ASCII'))
+    obj.update(json.dumps(
+        [_CACHE_VERSION, info['param']], sort_keys=True).encode('UTF-8'))
+    cache = ResultCache(
+        os.path.join(CACHE_DIR, obj.hexdigest()[:32] + '.json'))
+    missing = [p for p in pairs if cache.get(p, itercount) is None]
+    print('Cached: {}/{} pairs'.format(len(pairs) - len(missing), len(pairs)),
+          file=sys.stderr)
+    if missing:
+        # More shards than jobs, so a slow shard does not leave the
+        # other processes idle at the end.
+        shards = shard(missing, jobs * 4)
+        with concurrent.futures.ThreadPoolExecutor(jobs) as pool:
+            futures = [pool.submit(run_shard, s, itercount) for s in shards]
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    for result in future.result():
+                        cache.add(result, itercount)
+            finally:
+                # Keep finished pairs even if a shard fails.
+                for future in futures:
+                    future.cancel()
+                cache.save()
+    return [cache.get(p, itercount) for p in pairs]
+
+def run(itercount, *, jobs, output=None, compile=True):
+    """Simulate every pair of shapes and write the HTML table.
+
+    output: path to the output file, or None for standard output
+    compile: compile the TypeScript code first
+    """
+    if compile:
+        build.compile_ts(None, 'src/tsconfig.json')
+    results = run_table(itercount, jobs=jobs)
+    html = build.run_pipe(
+        ['node', SCRIPT, 'dump'], json.dumps(results).encode('UTF-8'))
+    if output:
+        with open(output, 'wb') as fp:
+            fp.write(html)
+    else:
+        sys.stdout.buffer.write(html)
+
+def main():
+    p = argparse.ArgumentParser(prog='python -m tools.combatsim')
+    p.add_argument('itercount', type=int,
+                   help='number of combats to simulate for each pair')
+    p.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                   help='number of Node processes to run at once')
+    p.add_argument('-o', '--output', metavar='PATH',
+                   help='write the HTML table to PATH')
+    p.add_argument('--no-compile', action='store_true',
+                   help='do not compile the TypeScript code first')
+    args = p.parse_args()
+    if args.itercount <= 0 or args.jobs <= 0:
+        p.error('iteration count and jobs must be positive')
+    try:
+        run(args.itercount, jobs=args.jobs, output=args.output,
+            compile=not args.no_compile)
+    except build.BuildFailure as ex:
+        print('Error: {}'.format(ex), file=sys.stderr)
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
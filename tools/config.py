@@ -3,14 +3,21 @@
 # This file is part of Kitten Teleporter.  The Kitten Teleporter source
 # code is distributed under the terms of the MIT license.
 # See LICENSE.txt for details.
+import json
 import yaml
-from mako import template
 
 CONFIG_DEFAULT = '''\
 ---
 # Local configuration, not checked into source control.
 '''
 
+# Config files, and whether they are created if missing.
+PATHS = [
+    ('tools/base.yaml', False),
+    ('config.yaml', False),
+    ('config_local.yaml', True),
+]
+
 class ConfigError(Exception):
     pass
 
@@ -25,19 +32,21 @@ class Config(object):
         'debug',
         'server_host',
         'server_port',
+        # Size budgets: map from file patterns to limits.
+        'budget',
+        # Shared store for build outputs: path and max_size.
+        'store',
+        # Most recent render: (key, result).
+        '_rendered',
     ]
 
     @classmethod
     def load(class_, action, config):
         """Load the project configuration."""
-        paths = [
-            ('tools/base.yaml', False),
-            ('config.yaml', False),
-            ('config_local.yaml', True),
-        ]
         infos = []
-        valid_keys = {'configs', 'server', 'default', 'config', 'env'}
-        for path, create in paths:
+        valid_keys = {'configs', 'server', 'default', 'config', 'env',
+                      'budget', 'store'}
+        for path, create in PATHS:
             try:
                 with open(path) as fp:
                     info = yaml.safe_load(fp)
@@ -61,6 +70,8 @@ class Config(object):
         all_configs = {'base'}
         server = {}
         env = []
+        budget = {}
+        store = {}
         for info in infos:
             try:
                 configs = info['configs']
@@ -79,6 +90,14 @@ class Config(object):
                 env = info['env']
             except KeyError:
                 pass
+            try:
+                budget.update(info['budget'])
+            except KeyError:
+                pass
+            try:
+                store.update(info['store'])
+            except KeyError:
+                pass
 
         if configs is None:
             raise ConfigError('Missing configs key.')
@@ -89,6 +108,11 @@ class Config(object):
         if extra:
             raise ConfigError('Unknown server flag: {}.'.format(fset(extra)))
 
+        valid_store = {'path', 'max_size'}
+        extra = set(store.keys()).difference(valid_store)
+        if extra:
+            raise ConfigError('Unknown store flag: {}.'.format(fset(extra)))
+
         valid_actions = {'serve', 'build', 'package', 'deploy'}
         extra = set(default.keys()).difference(valid_actions)
         if extra:
@@ -126,10 +150,21 @@ class Config(object):
         self.debug = self.defs['debug']
         self.server_host = server['host']
         self.server_port = server['port']
+        self.budget = budget
+        self.store = store
+        self._rendered = None
         return self
 
     def render(self, **kw):
-        """Render the config dictionary."""
+        """Render the config dictionary.
+
+        The result is memoized on the definitions and arguments, since
+        the server renders the config on every rebuild.
+        """
+        key = json.dumps([self.defs, kw], sort_keys=True)
+        if self._rendered is not None and self._rendered[0] == key:
+            return dict(self._rendered[1])
+        from . import tmplcache
         expanded = {'title', 'js_header', 'instructions'}
         context = dict(kw)
         context.update({key: value for key, value in self.defs.items()
@@ -139,7 +174,7 @@ class Config(object):
         for key in expanded:
             text = self.defs[key]
             try:
-                result[key] = template.Template(text).render(**context)
+                result[key] = tmplcache.from_text(text).render(**context)
             except:
                 print('Could not evaluate template:')
                 for line in text.splitlines():
@@ -149,7 +184,8 @@ class Config(object):
         for key in self.env:
             env[key] = result[key]
         result['env'] = env
-        return result
+        self._rendered = key, result
+        return dict(result)
 
     def dump(self, **kw):
         print('Configuration:')
@@ -0,0 +1,266 @@
+# Copyright 2016 Dietrich Epp.
+#
+# This file is part of Kitten Teleporter.  The Kitten Teleporter source
+# code is distributed under the terms of the MIT license.
+# See LICENSE.txt for details.
+"""Build daemon.
+
+The daemon keeps the configuration, application, and build system in
+memory and listens on a Unix socket, so rebuilds do not pay for
+interpreter startup or a cold build cache.  The command-line tool
+forwards build and package requests to the daemon if it is running.
+
+Protocol: the client sends one line of JSON with the request.  The
+daemon sends back frames, each a type byte and a 32-bit big-endian
+length followed by the data.  Output frames ("o") contain build output,
+and the last frame is a status frame ("s") containing JSON with the
+result.
+"""
+import contextlib
+import json
+import os
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import traceback
+from . import config
+
+SOCKET_PATH = 'build/daemon.sock'
+
+def _config_key():
+    """Get a key which changes when the config files change."""
+    key = []
+    for path, create in config.PATHS:
+        try:
+            key.append(os.stat(path).st_mtime)
+        except FileNotFoundError:
+            key.append(None)
+    return tuple(key)
+
+FRAME = struct.Struct('>cI')
+FRAME_OUTPUT = b'o'
+FRAME_STATUS = b's'
+
+def _send_frame(sock, ftype, data):
+    sock.sendall(FRAME.pack(ftype, len(data)) + data)
+
+def _flush():
+    """Flush standard output and error, ignoring errors."""
+    for fp in (sys.stdout, sys.stderr):
+        try:
+            fp.flush()
+        except OSError:
+            pass
+
+# Seconds to wait for the rest of the output after a request.  Child
+# processes which outlive the request keep the pipe open.
+PUMP_TIMEOUT = 1.0
+
+class _Pump(object):
+    """Thread which copies output from a pipe to the client.
+
+    The thread runs until the pipe is closed.  Once detached, or if
+    the client disconnects, the rest of the output is read and
+    discarded, so writes to the pipe do not fail or block.
+    """
+    __slots__ = ['fd', 'sock', 'lock', 'attached', 'thread']
+
+    def __init__(self, fd, sock):
+        self.fd = fd
+        self.sock = sock
+        # Held while sending, so no output is sent after detach().
+        self.lock = threading.Lock()
+        self.attached = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            while True:
+                data = os.read(self.fd, 1024 * 16)
+                if not data:
+                    break
+                with self.lock:
+                    if not self.attached:
+                        continue
+                    try:
+                        _send_frame(self.sock, FRAME_OUTPUT, data)
+                    except OSError:
+                        self.attached = False
+        finally:
+            os.close(self.fd)
+
+    def detach(self, timeout):
+        """Wait for the pipe to close, then stop sending output."""
+        self.thread.join(timeout)
+        with self.lock:
+            self.attached = False
+
+@contextlib.contextmanager
+def _redirect(sock):
+    """Redirect standard output and error to the client.
+
+    This is done at the file descriptor level so the output of
+    commands run by the build system is also redirected.  Output goes
+    through a pipe, and a thread sends it to the client in output
+    frames.
+    """
+    rfd, wfd = os.pipe()
+    pump = _Pump(rfd, sock)
+    _flush()
+    saved = [os.dup(1), os.dup(2)]
+    try:
+        os.dup2(wfd, 1)
+        os.dup2(wfd, 2)
+        yield
+    finally:
+        try:
+            _flush()
+        finally:
+            try:
+                os.dup2(saved[0], 1)
+                os.dup2(saved[1], 2)
+            finally:
+                os.close(saved[0])
+                os.close(saved[1])
+                # Closing the last write end stops the pump, unless
+                # a child process still has the pipe open.
+                os.close(wfd)
+                pump.detach(PUMP_TIMEOUT)
+
+class Daemon(object):
+    """Resident state for the build daemon."""
+    __slots__ = [
+        # Map from (action, config) to (config key, App).
+        'apps',
+    ]
+
+    def __init__(self):
+        self.apps = {}
+
+    def get_app(self, action, cfgname, *, verbose=False):
+        """Get the application for a request."""
+        from . import app
+        from . import build
+        from . import store
+        key = _config_key()
+        try:
+            ckey, obj = self.apps[action, cfgname]
+        except KeyError:
+            pass
+        else:
+            if ckey == key:
+                return obj
+        cfg = config.Config.load(action, cfgname)
+        if verbose:
+            cfg.dump(version='v0.0.0')
+        obj = app.App(
+            cfg, build.BuildSystem(store=store.open_store(cfg.store)))
+        self.apps[action, cfgname] = key, obj
+        return obj
+
+    def run(self, request):
+        """Run a request, and return the exit status."""
+        from . import build
+        action = request['action']
+        if action not in ('build', 'package'):
+            print('Invalid action: {!r}'.format(action))
+            return 1
+        try:
+            obj = self.get_app(action, request.get('config'),
+                               verbose=request.get('verbose', False))
+        except config.ConfigError as ex:
+            print(ex)
+            return 1
+        try:
+            obj.build()
+            if action == 'package':
+                obj.package()
+        except build.BuildFailure as ex:
+            print('Build failed: {}'.format(ex))
+            return 1
+        return 0
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        try:
+            request = json.loads(line.decode('UTF-8'))
+        except ValueError:
+            return
+        print('Request: {}'.format(request.get('action')))
+        with _redirect(self.connection):
+            try:
+                status = self.server.daemon.run(request)
+            except Exception:
+                traceback.print_exc()
+                status = 1
+        try:
+            _send_frame(self.connection, FRAME_STATUS,
+                        json.dumps({'status': status}).encode('UTF-8'))
+        except OSError:
+            print('Client disconnected')
+
+class Server(socketserver.UnixStreamServer):
+    def __init__(self, path):
+        super(Server, self).__init__(path, Handler)
+        self.daemon = Daemon()
+
+def serve(path=SOCKET_PATH):
+    """Run the build daemon."""
+    dirname = os.path.dirname(path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    if os.path.exists(path):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(path)
+        except ConnectionRefusedError:
+            os.unlink(path)
+        else:
+            print('Daemon is already running: {}'.format(path))
+            raise SystemExit(1)
+        finally:
+            sock.close()
+    server = Server(path)
+    print('Listening on {}'.format(path))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
+
+def request(action, cfgname, *, verbose=False, path=SOCKET_PATH):
+    """Send a request to the build daemon.
+
+    Returns the exit status, or None if no daemon is running.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        sock.close()
+        return None
+    with sock:
+        req = {'action': action, 'config': cfgname, 'verbose': verbose}
+        sock.sendall(json.dumps(req).encode('UTF-8') + b'\n')
+        out = sys.stdout.buffer
+        with sock.makefile('rb') as fp:
+            while True:
+                header = fp.read(FRAME.size)
+                if len(header) < FRAME.size:
+                    break
+                ftype, size = FRAME.unpack(header)
+                data = fp.read(size)
+                if len(data) < size:
+                    break
+                if ftype == FRAME_STATUS:
+                    return json.loads(data.decode('UTF-8'))['status']
+                out.write(data)
+                out.flush()
+    print('Build daemon closed connection')
+    return 1
@@ -8,21 +8,29 @@
 This will generate a bitmap font from input font files.  This uses the
 Python FreeType module (freetype-py).  Rather than using config files,
 this should be called directly from Python code.
+
+FreeType, NumPy, and PIL are imported when they are first needed, so
+importing this module is cheap.
 """
 import collections
-import freetype
 import json
-import numpy
-import PIL.Image
 from . import rectpack
 
 ASCII_PRINT = ''.join(chr(x) for x in range(32, 127))
 
+# Version of the rendered font cache format.
+_CACHE_VERSION = 2
+
 class AlphaStyle(object):
     """Base style type."""
+    # Ratio of rendered size to nominal size.
+    scale = 1
     def _init_face(self, face, size):
-        face.set_char_size(round(size * 64))
+        face.set_char_size(round(size * 64 * self.scale))
+    def _update_info(self, info):
+        pass
     def _get_glyph(self, face, c, idx):
+        import numpy
         gidx = face.get_char_index(c)
         face.load_glyph(gidx)
         bitmap = face.glyph.bitmap
@@ -37,9 +45,170 @@ class AlphaStyle(object):
             idx,
             gidx)
 
+def _distance_sq(mask, limit):
+    """Compute the squared distance to the nearest set pixel in a mask.
+
+    Distances are exact up to the limit, larger distances are not.
+    This uses the separable transform: vertical distances first, then
+    the minimum over horizontal offsets, vectorized across the image.
+    """
+    import numpy
+    h, w = mask.shape
+    far = float(h + w + limit)
+    g = numpy.where(mask, 0.0, far).astype(numpy.float32)
+    for y in range(1, h):
+        numpy.minimum(g[y], g[y-1] + 1, out=g[y])
+    for y in range(h - 2, -1, -1):
+        numpy.minimum(g[y], g[y+1] + 1, out=g[y])
+    g *= g
+    d = g.copy()
+    for dx in range(1, min(limit, w - 1) + 1):
+        c = dx * dx
+        numpy.minimum(d[:,dx:], g[:,:-dx] + c, out=d[:,dx:])
+        numpy.minimum(d[:,:-dx], g[:,dx:] + c, out=d[:,:-dx])
+    return d
+
+class SDFStyle(AlphaStyle):
+    """Signed distance field style.
+
+    Glyphs are rendered at a higher resolution, converted to a distance
+    field, and scaled down.  The distance field can be drawn at any
+    scale with a threshold in the fragment shader.
+
+    spread: Distance range, in pixels at nominal size
+    scale: Ratio of rendering resolution to nominal size
+    """
+    def __init__(self, *, spread=4, scale=4):
+        self.spread = spread
+        self.scale = scale
+    def _update_info(self, info):
+        info['sdf'] = self.spread
+    def _get_glyph(self, face, c, idx):
+        import numpy
+        g = super(SDFStyle, self)._get_glyph(face, c, idx)
+        u = self.scale
+        advance = int((face.glyph.advance.x / u + 64 / 2) / 64)
+        if not g.arr.size:
+            return g._replace(advance=advance, bx=0, by=0)
+        r = self.spread * u
+        # Pad so the glyph origin stays on a pixel boundary at
+        # nominal size.
+        left = r + (g.bx - r) % u
+        top = r + (-(g.by + r)) % u
+        h, w = g.arr.shape
+        right = r + (-(left + w + r)) % u
+        bottom = r + (-(top + h + r)) % u
+        arr = numpy.zeros((top + h + bottom, left + w + right), numpy.uint8)
+        arr[top:top+h,left:left+w] = g.arr
+        inside = arr >= 128
+        dist = (numpy.sqrt(_distance_sq(inside, r)) -
+                numpy.sqrt(_distance_sq(~inside, r)))
+        # Average down to nominal size.
+        hh, ww = dist.shape
+        dist = dist.reshape(hh // u, u, ww // u, u).mean(axis=(1, 3))
+        value = numpy.clip(0.5 - dist / (2 * r), 0.0, 1.0)
+        return g._replace(
+            advance=advance,
+            bx=(g.bx - left) // u,
+            by=(g.by + top) // u,
+            arr=numpy.round(value * 255).astype(numpy.uint8))
+
 _Glyph = collections.namedtuple('_Glyph', 'chr advance bx by arr idx gidx')
 _Font = collections.namedtuple('_Font', 'glyphs margin info')
 
+def _render(name, size, path, charset, style):
+    """Render the glyphs in a font.
+
+    Returns (glyphs, info).  Glyph indexes start at zero.
+    """
+    import freetype
+    import math
+    face = freetype.Face(path)
+    style._init_face(face, size)
+    info = {}
+    if name is None:
+        info['name'] = face.family_name.decode('ASCII')
+    else:
+        info['name'] = name
+    info['bold'] = bool(face.style_flags & freetype.FT_STYLE_FLAG_BOLD)
+    info['italic'] = bool(face.style_flags & freetype.FT_STYLE_FLAG_ITALIC)
+    info['size'] = size
+    style._update_info(info)
+    m = face.size
+    div = 64 * style.scale
+    info['ascender'] = math.floor(m.ascender / div + 0.5)
+    info['descender'] = math.floor(m.descender / div + 0.5)
+    info['height'] = math.floor(m.height / div + 0.5)
+    glyphs = []
+    for i, c in enumerate(charset):
+        glyphs.append(style._get_glyph(face, c, i))
+    kern = []
+    for nx, gx in enumerate(glyphs):
+        for ny, gy in enumerate(glyphs):
+            kx = math.floor(
+                face.get_kerning(gx.chr, gy.chr,
+                                 freetype.FT_KERNING_DEFAULT).x / div)
+            if kx:
+                kern.append((nx, ny, kx))
+    if kern:
+        info['kern'] = kern
+    return glyphs, info
+
+def _render_cached(cache, name, size, path, charset, style):
+    """Render the glyphs in a font, using a cache directory.
+
+    The cache is keyed on the font file contents, the size, the
+    character set, and the style, so unchanged fonts are not rendered
+    again.
+    """
+    import hashlib
+    import os
+    import pickle
+    import tempfile
+    obj = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        obj.update(fp.read())
+    obj.update(repr((
+        _CACHE_VERSION, name, size, ''.join(charset),
+        type(style).__name__, sorted(vars(style).items()),
+    )).encode('UTF-8'))
+    cache_path = os.path.join(cache, obj.hexdigest()[:32] + '.pickle')
+    try:
+        with open(cache_path, 'rb') as fp:
+            return pickle.load(fp)
+    except FileNotFoundError:
+        pass
+    result = _render(name, size, path, charset, style)
+    os.makedirs(cache, exist_ok=True)
+    # Other processes may be writing the same file.
+    fd, tmp_path = tempfile.mkstemp(dir=cache, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            pickle.dump(result, fp, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    return result
+
+def render(*, name=None, size, path,
+           charset=ASCII_PRINT, style=AlphaStyle(), cache=None):
+    """Render the glyphs in a font.
+
+    This is separate from FontSet.add so fonts can be rendered in other
+    processes.  The arguments are the same as FontSet.add.  Returns an
+    opaque value to pass to FontSet.add_rendered.
+    """
+    charset = sorted(set(charset))
+    if not all(isinstance(c, str) and len(c) == 1 for c in charset):
+        raise TypeError('invalid character set')
+    if cache is None:
+        return _render(name, size, path, charset, style)
+    return _render_cached(cache, name, size, path, charset, style)
+
 class FontSet(object):
     """A set of fonts to render to a bitmap."""
     __slots__ = ['_depth', '_fonts', '_rects']
@@ -50,58 +219,45 @@ class FontSet(object):
         self._rects = []
 
     def add(self, *, name=None, size, path,
-            margin=1, charset=ASCII_PRINT, style=AlphaStyle()):
-        """Add an alpha mask font to the font set.
+            margin=1, charset=ASCII_PRINT, style=AlphaStyle(), cache=None):
+        """Add a font to the font set.
 
         size: Font size, in pixels (floats are okay)
         path: Path to the font file
         margin: Margin on all sides of each glyph
         charset: Set of characters to include
         style: Style for bitmap rendering
+        cache: Directory for caching rendered glyphs, or None
         """
-        charset = sorted(set(charset))
-        if not all(isinstance(c, str) and len(c) == 1 for c in charset):
-            raise TypeError('invalid character set')
-        face = freetype.Face(path)
-        style._init_face(face, size)
-        info = {}
-        if name is None:
-            info['name'] = face.family_name.decode('ASCII')
-        else:
-            info['name'] = name
-        info['bold'] = bool(face.style_flags & freetype.FT_STYLE_FLAG_BOLD)
-        info['italic'] = bool(face.style_flags & freetype.FT_STYLE_FLAG_ITALIC)
-        info['size'] = size
-        m = face.size
-        info['ascender'] = (m.ascender + 32) >> 6
-        info['descender'] = (m.descender + 32) >> 6
-        info['height'] = (m.height + 32) >> 6
-        glyphs = []
-        for i, c in enumerate(charset, len(self._rects)):
-            g = style._get_glyph(face, c, i)
-            glyphs.append(g)
+        self.add_rendered(
+            render(name=name, size=size, path=path, charset=charset,
+                   style=style, cache=cache),
+            margin=margin)
+
+    def add_rendered(self, rendered, *, margin=1):
+        """Add a font returned by render() to the font set."""
+        glyphs, info = rendered
+        base = len(self._rects)
+        glyphs = [g._replace(idx=g.idx + base) for g in glyphs]
+        for g in glyphs:
             self._rects.append((
                 g.arr.shape[1] + margin * 2,
                 g.arr.shape[0] + margin * 2,
             ))
-        kern = []
-        for nx, gx in enumerate(glyphs):
-            gkern = []
-            for ny, gy in enumerate(glyphs):
-                kx = face.get_kerning(gx.chr, gy.chr,
-                                      freetype.FT_KERNING_DEFAULT).x >> 6
-                if not kx:
-                    continue
-                gkern.append('{},{}'.format(ny, kx))
-            if gkern:
-                kern.append('{},{}'.format(nx, ','.join(gkern)))
-        if kern:
-            info['kern'] = ':'.join(kern)
         self._fonts.append(_Font(glyphs, margin, info))
 
-    def save(self, *, image_path, json_path):
-        """Save the font set to the given image and json files."""
-        pack = rectpack.pack(self._rects)
+    def pack(self):
+        """Pack the font set into an image.
+
+        Returns (image, data), where image is a NumPy array and data is
+        the font metadata.  The glyph and kerning tables in the metadata
+        are lists, use encode() to convert them to binary.
+        """
+        import numpy
+        if len(set('sdf' in font.info for font in self._fonts)) > 1:
+            raise Exception('cannot mix SDF and alpha fonts in one atlas')
+        # Glyphs are not rotated, the glyph table has no room for it.
+        pack = rectpack.pack(self._rects, method='best')
         if not pack:
             raise Exception('font packing failed')
         data = []
@@ -126,14 +282,64 @@ class FontSet(object):
             fdata = dict(font.info)
             fdata.update(
                 char=''.join(g.chr for g in font.glyphs),
-                glyph=','.join(str(n) for n in gdata),
+                glyph=gdata,
             )
             data.append(fdata)
         print('Fonts: {}'.format(len(self._fonts)))
         print('Glyphs: {}'.format(len(self._rects)))
+        return a, data
+
+    def save(self, *, image_path, json_path):
+        """Save the font set to the given image and json files.
+
+        The binary tables are saved next to the json file, with the
+        extension .bin.
+        """
+        import os
+        import PIL.Image
+        a, data = self.pack()
+        data, bdata = encode(data)
         print('Writing data to {}'.format(json_path))
         with open(json_path, 'w') as fp:
             json.dump(data, fp, indent=2, sort_keys=True)
+        with open(os.path.splitext(json_path)[0] + '.bin', 'wb') as fp:
+            fp.write(bdata)
         print('Writing image to {}'.format(image_path))
         img = PIL.Image.fromarray(a)
         img.save(image_path)
+
+def encode(data):
+    """Encode the glyph and kerning tables in font metadata as binary.
+
+    Returns (data, bdata), where data is the metadata with offsets into
+    the binary data bdata.  For each font, the binary data contains
+    little-endian arrays:
+
+    glyph: int16[glyphcount * 7], see FontSet.pack
+    kernIndex: uint16[glyphcount + 1], kerning pairs for glyph i are
+        kernIndex[i] to kernIndex[i+1]
+    kernRight: int16[kernCount], right glyph in each pair, sorted
+    kernAmount: int16[kernCount], kerning for each pair
+    """
+    import struct
+    out = bytearray()
+    result = []
+    for fdata in data:
+        fdata = dict(fdata)
+        glyph = fdata.pop('glyph')
+        kern = sorted(fdata.pop('kern', ()))
+        n = len(fdata['char'])
+        fdata['glyphOffset'] = len(out)
+        out += struct.pack('<{}h'.format(len(glyph)), *glyph)
+        index = [0] * (n + 1)
+        for left, right, amount in kern:
+            index[left + 1] += 1
+        for i in range(n):
+            index[i + 1] += index[i]
+        fdata['kernOffset'] = len(out)
+        fdata['kernCount'] = len(kern)
+        out += struct.pack('<{}H'.format(n + 1), *index)
+        out += struct.pack('<{}h'.format(len(kern)), *[k[1] for k in kern])
+        out += struct.pack('<{}h'.format(len(kern)), *[k[2] for k in kern])
+        result.append(fdata)
+    return result, bytes(out)
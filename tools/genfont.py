@@ -3,32 +3,152 @@
 # This file is part of Kitten Teleporter.  The Kitten Teleporter source
 # code is distributed under the terms of the MIT license.
 # See LICENSE.txt for details.
-"""Generate font files for this project."""
+"""Generate font files for this project.
+
+This is normally run by the build system, but can be run directly to
+inspect the output.  The fonts are listed in assets/fonts.yaml.  Each
+font only includes the characters used by the strings in its text
+sources, plus any extra characters it lists.  The build renders a
+distance field atlas if the font_sdf config option is set.
+"""
+import argparse
+import json
 import os
+import yaml
 from . import font
 
+SPEC = 'assets/fonts.yaml'
+
 FULL1_CHARSET = font.ASCII_PRINT + "“”‘’–—…‹›«»×©"
 
+CHARSETS = {
+    'ascii': font.ASCII_PRINT,
+    'full1': FULL1_CHARSET,
+}
+
+def text_strings(obj):
+    """Get all strings in a YAML document."""
+    if isinstance(obj, str):
+        yield obj
+    elif isinstance(obj, dict):
+        for value in obj.values():
+            yield from text_strings(value)
+    elif isinstance(obj, list):
+        for value in obj:
+            yield from text_strings(value)
+
+def load_spec(path):
+    """Load the font specification.
+
+    Returns a list of dictionaries with the keyword arguments for
+    FontSet.add for each font, except the style.
+    """
+    with open(path) as fp:
+        spec = yaml.safe_load(fp)
+    root = os.path.dirname(path)
+    fonts = []
+    for fspec in spec:
+        chars = set()
+        for tpath in fspec.get('text', ()):
+            with open(os.path.join(root, tpath)) as fp:
+                for s in text_strings(yaml.safe_load(fp)):
+                    chars.update(s)
+        extra = fspec.get('charset', '')
+        chars.update(CHARSETS.get(extra, extra))
+        # Line breaks are handled by layout, not drawn, but spaces
+        # need their advance.
+        chars.difference_update('\n\r\t\u2028\u2029')
+        chars.add(' ')
+        kw = {
+            'path': os.path.join(root, 'fonts', fspec['path']),
+            'size': fspec['size'],
+            'margin': fspec.get('margin', 1),
+            'charset': ''.join(sorted(chars)),
+        }
+        if 'name' in fspec:
+            kw['name'] = fspec['name']
+        fonts.append(kw)
+    return fonts
+
+def spec_deps(path):
+    """Get the files which the font specification depends on."""
+    with open(path) as fp:
+        spec = yaml.safe_load(fp)
+    root = os.path.dirname(path)
+    deps = {path}
+    for fspec in spec:
+        deps.add(os.path.join(root, 'fonts', fspec['path']))
+        for tpath in fspec.get('text', ()):
+            deps.add(os.path.join(root, tpath))
+    return sorted(deps)
+
+def render_atlas(specs, *, style=None, cache=None):
+    """Render and pack the fonts in a font specification.
+
+    The fonts are rendered in parallel.  Returns (png, data), the
+    PNG image data and the font metadata.
+
+    specs: font specification from load_spec
+    cache: Directory for caching rendered fonts, or None
+    """
+    import concurrent.futures
+    import io
+    import PIL.Image
+    if style is None:
+        style = font.AlphaStyle()
+    specs = [dict(kw) for kw in specs]
+    margins = [kw.pop('margin') for kw in specs]
+    if len(specs) > 1:
+        with concurrent.futures.ProcessPoolExecutor() as pool:
+            futures = [pool.submit(font.render, style=style, cache=cache,
+                                   **kw)
+                       for kw in specs]
+            rendered = [f.result() for f in futures]
+    else:
+        rendered = [font.render(style=style, cache=cache, **kw)
+                    for kw in specs]
+    s = font.FontSet()
+    for r, margin in zip(rendered, margins):
+        s.add_rendered(r, margin=margin)
+    a, data = s.pack()
+    fp = io.BytesIO()
+    PIL.Image.fromarray(a).save(fp, 'PNG')
+    return fp.getvalue(), data
+
+def generate(spec_path, *, image_path, style=None, cache=None):
+    """Generate the font atlas from a font specification.
+
+    Writes the image and returns the font metadata.
+
+    cache: Directory for caching rendered fonts, or None
+    """
+    png, data = render_atlas(load_spec(spec_path), style=style, cache=cache)
+    dirname = os.path.dirname(image_path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    with open(image_path, 'wb') as fp:
+        fp.write(png)
+    return data
+
 if __name__ == '__main__':
+    p = argparse.ArgumentParser(prog='python -m tools.genfont')
+    p.add_argument('--sdf', action='store_true',
+                   help='generate a signed distance field atlas')
+    p.add_argument('-o', '--output', default='build/fonts',
+                   help='output directory')
+    args = p.parse_args()
     join = os.path.join
-    adir = join(
-        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
-        'assets')
-    fdir = join(adir, 'fonts')
-    s = font.FontSet()
-    s.add(
-        charset=FULL1_CHARSET,
-        size=64,
-        margin=4,
-        path=join(fdir, 'almendra/Almendra-Regular.ttf'),
-    )
-    s.add(
-        charset=FULL1_CHARSET,
-        size=32,
-        margin=2,
-        path=join(fdir, 'patrickhand/PatrickHand-Regular.ttf'),
-    )
-    s.save(
-        image_path=join(adir, 'images', 'fonts.png'),
-        json_path=join(adir, 'images', 'fonts.json'),
+    image_path = join(args.output, 'fonts.png')
+    json_path = join(args.output, 'fonts.json')
+    data = generate(
+        SPEC,
+        image_path=image_path,
+        style=font.SDFStyle() if args.sdf else font.AlphaStyle(),
+        cache=join(args.output, 'cache'),
     )
+    data, bdata = font.encode(data)
+    with open(json_path, 'w') as fp:
+        json.dump(data, fp, indent=2, sort_keys=True)
+    with open(join(args.output, 'fonts.bin'), 'wb') as fp:
+        fp.write(bdata)
+    print('Wrote fonts to {}'.format(args.output))
@@ -0,0 +1,584 @@
+# Copyright 2016 Dietrich Epp.
+#
+# This file is part of Kitten Teleporter.  The Kitten Teleporter source
+# code is distributed under the terms of the MIT license.
+# See LICENSE.txt for details.
+"""GLSL minifier.
+
+This removes comments and whitespace from GLSL ES source code, and
+renames local variables and varyings to short names.  Attributes,
+uniforms, functions, struct members, global variables, and anything
+mentioned by a preprocessor directive keep their names.
+"""
+import collections
+import re
+
+Token = collections.namedtuple('Token', 'type text')
+
+TOKEN = re.compile(
+    r'(?P<space>[ \t\r\n]+)'
+    r'|(?P<comment>//[^\n]*|/\*.*?\*/)'
+    r'|(?P<directive>\#(?:[^\n\\]|\\.)*)'
+    r'|(?P<ident>[A-Za-z_][A-Za-z0-9_]*)'
+    r'|(?P<number>(?:\d+\.\d*|\.\d+|\d+)(?:[eE][-+]?\d+)?'
+    r'|0[xX][0-9A-Fa-f]+)'
+    r'|(?P<op><<=|>>=|\+\+|--|<<|>>|<=|>=|==|!=|&&|\|\||\^\^'
+    r'|[-+*/%&|^]=|[-+*/%&|^!~<>=?:;,.()\[\]{}])',
+    re.DOTALL)
+
+TYPES = {
+    'void', 'bool', 'int', 'float',
+    'vec2', 'vec3', 'vec4', 'bvec2', 'bvec3', 'bvec4',
+    'ivec2', 'ivec3', 'ivec4', 'mat2', 'mat3', 'mat4',
+    'sampler2D', 'samplerCube',
+}
+
+QUALIFIERS = {
+    'const', 'attribute', 'uniform', 'varying', 'in', 'out', 'inout',
+    'highp', 'mediump', 'lowp', 'invariant', 'precision',
+}
+
+# Names which are never generated: keywords, reserved words, and
+# built-in functions of GLSL ES 1.00.
+RESERVED = TYPES | QUALIFIERS | {
+    'break', 'continue', 'do', 'else', 'for', 'if', 'discard', 'return',
+    'struct', 'true', 'false', 'while',
+    'asm', 'class', 'union', 'enum', 'typedef', 'template', 'this',
+    'packed', 'goto', 'switch', 'default', 'inline', 'noinline',
+    'volatile', 'public', 'static', 'extern', 'external', 'interface',
+    'flat', 'long', 'short', 'double', 'half', 'fixed', 'unsigned',
+    'superp', 'input', 'output', 'hvec2', 'hvec3', 'hvec4', 'dvec2',
+    'dvec3', 'dvec4', 'fvec2', 'fvec3', 'fvec4', 'sampler1D',
+    'sampler3D', 'sampler1DShadow', 'sampler2DShadow', 'sampler2DRect',
+    'sampler3DRect', 'sampler2DRectShadow', 'sizeof', 'cast',
+    'namespace', 'using',
+    'radians', 'degrees', 'sin', 'cos', 'tan', 'asin', 'acos', 'atan',
+    'pow', 'exp', 'log', 'exp2', 'log2', 'sqrt', 'inversesqrt',
+    'abs', 'sign', 'floor', 'ceil', 'fract', 'mod', 'min', 'max',
+    'clamp', 'mix', 'step', 'smoothstep', 'length', 'distance', 'dot',
+    'cross', 'normalize', 'faceforward', 'reflect', 'refract',
+    'matrixCompMult', 'lessThan', 'lessThanEqual', 'greaterThan',
+    'greaterThanEqual', 'equal', 'notEqual', 'any', 'all', 'not',
+    'texture2D', 'texture2DProj', 'texture2DLod', 'texture2DProjLod',
+    'textureCube', 'textureCubeLod', 'main',
+}
+
+def tokenize(text):
+    """Split GLSL source code into tokens."""
+    tokens = []
+    pos = 0
+    while pos < len(text):
+        m = TOKEN.match(text, pos)
+        if not m:
+            raise ValueError('invalid character: {!r}'.format(text[pos]))
+        tokens.append(Token(m.lastgroup, m.group()))
+        pos = m.end()
+    return tokens
+
+def _significant(tokens):
+    return [t for t in tokens if t.type not in ('space', 'comment')]
+
+class Names(object):
+    """Declared names in a shader."""
+    __slots__ = [
+        # Names of all identifiers in the shader.
+        'all',
+        # Names of varyings.
+        'varyings',
+        # Names which may be renamed: locals and parameters.
+        'local',
+        # Names which must not be renamed.
+        'fixed',
+    ]
+
+def scan(tokens):
+    """Find the declared names in a list of tokens."""
+    tokens = _significant(tokens)
+    names = Names()
+    names.all = {t.text for t in tokens if t.type == 'ident'}
+    names.varyings = set()
+    names.local = set()
+    names.fixed = set()
+    types = set(TYPES)
+    braces = []
+    paren = 0
+    quals = set()
+    decl = None
+    struct = False
+    prev = None
+    for i, t in enumerate(tokens):
+        nxt = tokens[i + 1] if i + 1 < len(tokens) else None
+        if t.type == 'directive':
+            for m in re.finditer(r'[A-Za-z_][A-Za-z0-9_]*', t.text):
+                names.fixed.add(m.group())
+        elif t.type == 'ident':
+            name = t.text
+            if prev is not None and prev.text == '.':
+                names.fixed.add(name)
+            elif name == 'struct':
+                struct = True
+            elif struct and name not in types:
+                types.add(name)
+                names.fixed.add(name)
+            elif name in QUALIFIERS:
+                if not braces and not paren:
+                    quals.add(name)
+            elif name in types:
+                pass
+            elif nxt is not None and nxt.text == '(':
+                if prev is not None and prev.text in types:
+                    # Function definition or prototype
+                    names.fixed.add(name)
+            elif ((prev is not None and prev.text in types) or
+                  (decl is not None and prev.text == ',' and
+                   paren == decl)):
+                # Declaration
+                if prev.text in types:
+                    decl = paren
+                if braces and braces[-1] == 'struct':
+                    names.fixed.add(name)
+                elif braces or paren:
+                    names.local.add(name)
+                elif 'varying' in quals:
+                    names.varyings.add(name)
+                else:
+                    names.fixed.add(name)
+        elif t.type == 'op':
+            op = t.text
+            if op == '(':
+                paren += 1
+            elif op == ')':
+                paren -= 1
+                if decl is not None and paren < decl:
+                    decl = None
+            elif op == '{':
+                braces.append('struct' if struct else 'block')
+                struct = False
+                decl = None
+            elif op == '}':
+                braces.pop()
+                if not braces:
+                    quals = set()
+            elif op == ';':
+                decl = None
+                if not braces and not paren:
+                    quals = set()
+        prev = t
+    names.local.difference_update(names.fixed, names.varyings)
+    names.local = {n for n in names.local if not n.startswith('gl_')}
+    return names
+
+def short_names(used):
+    """Generate short identifiers which are not in the given set."""
+    first = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    rest = first + '0123456789_'
+    n = 0
+    while True:
+        i = n
+        name = first[i % len(first)]
+        i //= len(first)
+        while i:
+            i -= 1
+            name += rest[i % len(rest)]
+            i //= len(rest)
+        n += 1
+        if name not in used and name not in RESERVED and '__' not in name:
+            yield name
+
+def _needs_space(a, b):
+    """Test whether a space is needed between two tokens."""
+    if a.type == 'directive' or b.type == 'directive':
+        return False
+    s = a.text + b.text
+    m = TOKEN.match(s)
+    return m is None or m.end() != len(a.text)
+
+def minify(text, *, rename=None):
+    """Minify GLSL source code.
+
+    rename: map from names to new names, used for varyings
+    """
+    tokens = _significant(tokenize(text))
+    names = scan(tokens)
+    rename = {k: v for k, v in (rename or {}).items()
+              if k in names.varyings}
+    used = names.all | set(rename.values())
+    gen = short_names(used)
+    # Rename the most frequently used names first, to get the
+    # shortest names.
+    counts = collections.Counter(
+        t.text for t in tokens if t.text in names.local)
+    for name, count in sorted(counts.items(), key=lambda x: (-x[1], x[0])):
+        rename[name] = next(gen)
+    out = []
+    prev = None
+    for t in tokens:
+        if (t.type == 'ident' and t.text in rename and
+                not (prev is not None and prev.text == '.')):
+            t = Token('ident', rename[t.text])
+        if t.type == 'directive':
+            text = ' '.join(t.text.replace('\\\n', ' ').split())
+            if out and out[-1] != '\n':
+                out.append('\n')
+            out.append(text)
+            out.append('\n')
+        else:
+            if prev is not None and _needs_space(prev, t):
+                out.append(' ')
+            out.append(t.text)
+        prev = t
+    return ''.join(out).strip()
+
+def rename_varyings(texts):
+    """Get a map for renaming varyings across a set of shaders.
+
+    The same varying gets the same name in every shader, so vertex
+    and fragment shaders still match.
+    """
+    varyings = set()
+    used = set()
+    for text in texts:
+        names = scan(tokenize(text))
+        varyings.update(names.varyings)
+        used.update(names.all)
+    gen = short_names(used)
+    return {name: next(gen) for name in sorted(varyings)}
+
+# Macros defined by the GLSL implementation.  Conditionals which use
+# them are left for the shader compiler.
+PREDEFINED = {
+    'GL_ES', 'GL_FRAGMENT_PRECISION_HIGH', '__VERSION__', '__LINE__',
+    '__FILE__',
+}
+
+COND_TOKEN = re.compile(
+    r'\s*(?:([A-Za-z_]\w*)|(0[xX][0-9A-Fa-f]+|\d+)[uUlL]*'
+    r'|(&&|\|\||<<|>>|==|!=|<=|>=|[-+*/%&|^!~<>()]))')
+
+# Binary operators and their precedence, as in C.
+BINARY = {
+    '||': 1, '&&': 2, '|': 3, '^': 4, '&': 5, '==': 6, '!=': 6,
+    '<': 7, '>': 7, '<=': 7, '>=': 7, '<<': 8, '>>': 8,
+    '+': 9, '-': 9, '*': 10, '/': 10, '%': 10,
+}
+
+def _parse_int(text):
+    """Parse an integer literal, as in C."""
+    if text[:2] in ('0x', '0X'):
+        return int(text[2:], 16)
+    if len(text) > 1 and text[0] == '0':
+        return int(text, 8)
+    return int(text)
+
+def _div(x, y):
+    """Integer division, rounding towards zero as in C."""
+    if y == 0:
+        raise ValueError('division by zero in #if')
+    q = abs(x) // abs(y)
+    return q if (x < 0) == (y < 0) else -q
+
+def _binary(op, x, y):
+    """Evaluate a binary operator.  None is an unknown value."""
+    if op == '&&':
+        if x == 0 or y == 0:
+            return 0
+    elif op == '||':
+        if x or y:
+            return 1
+    if x is None or y is None:
+        return None
+    if op == '&&':
+        return 1
+    if op == '||':
+        return 0
+    if op == '/':
+        return _div(x, y)
+    if op == '%':
+        return x - y * _div(x, y)
+    return int({
+        '|': lambda: x | y, '^': lambda: x ^ y, '&': lambda: x & y,
+        '==': lambda: x == y, '!=': lambda: x != y,
+        '<': lambda: x < y, '>': lambda: x > y,
+        '<=': lambda: x <= y, '>=': lambda: x >= y,
+        '<<': lambda: x << y, '>>': lambda: x >> y,
+        '+': lambda: x + y, '-': lambda: x - y, '*': lambda: x * y,
+    }[op]())
+
+class _CondParser(object):
+    """Parser for the expression in an #if directive.
+
+    Values are None if they depend on a macro which is not known.
+    """
+    __slots__ = ['expr', 'tokens', 'pos', 'defines', 'known']
+
+    def __init__(self, expr, defines, known):
+        self.expr = expr
+        self.tokens = []
+        self.pos = 0
+        self.defines = defines
+        self.known = known
+        expr = expr.strip()
+        pos = 0
+        while pos < len(expr):
+            m = COND_TOKEN.match(expr, pos)
+            if not m:
+                self.error()
+            pos = m.end()
+            self.tokens.append(m.groups())
+
+    def error(self):
+        raise ValueError('invalid #if expression: {!r}'.format(self.expr))
+
+    def next(self):
+        if self.pos >= len(self.tokens):
+            self.error()
+        tok = self.tokens[self.pos]
+        self.pos += 1
+        return tok
+
+    def peek_op(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos][2]
+        return None
+
+    def expect(self, op):
+        if self.next()[2] != op:
+            self.error()
+
+    def macro(self, name):
+        """Get the value of a macro used in an expression."""
+        if name not in self.known:
+            return None
+        try:
+            return _parse_int(self.defines.get(name, '0'))
+        except ValueError:
+            raise ValueError('non-integer macro in #if: {}'.format(name))
+
+    def defined(self):
+        """Parse the operand of 'defined'."""
+        paren = self.peek_op() == '('
+        if paren:
+            self.next()
+        name = self.next()[0]
+        if name is None:
+            self.error()
+        if paren:
+            self.expect(')')
+        if name not in self.known:
+            return None
+        return int(name in self.defines)
+
+    def unary(self):
+        name, number, op = self.next()
+        if name == 'defined':
+            return self.defined()
+        if name is not None:
+            return self.macro(name)
+        if number is not None:
+            return _parse_int(number)
+        if op == '(':
+            value = self.binary(1)
+            self.expect(')')
+            return value
+        if op in ('!', '~', '-', '+'):
+            value = self.unary()
+            if value is None:
+                return None
+            return {'!': lambda: int(not value), '~': lambda: ~value,
+                    '-': lambda: -value, '+': lambda: value}[op]()
+        self.error()
+
+    def binary(self, level):
+        """Parse operators with at least the given precedence."""
+        x = self.unary()
+        while True:
+            op = self.peek_op()
+            prec = BINARY.get(op)
+            if prec is None or prec < level:
+                return x
+            self.next()
+            x = _binary(op, x, self.binary(prec + 1))
+
+    def parse(self):
+        value = self.binary(1)
+        if self.pos != len(self.tokens):
+            self.error()
+        return value
+
+def _eval_cond(expr, defines, known):
+    """Evaluate the expression in an #if directive.
+
+    Returns None if the result depends on a macro which is not known.
+    """
+    value = _CondParser(expr, defines, known).parse()
+    return None if value is None else bool(value)
+
+def _fold_cond(expr, defines, known):
+    """Replace known macros in an #if expression which is kept.
+
+    The definitions of known macros may have been removed, and GLSL ES
+    does not allow undefined macros in #if.  So defined() of a known
+    macro becomes 1 or 0, and known macros which are not defined
+    become 0.  Other macros are left for the shader compiler.
+    """
+    tokens = _CondParser(expr, defines, known).tokens
+    out = []
+    i = 0
+    while i < len(tokens):
+        name, number, op = tokens[i]
+        i += 1
+        if name == 'defined':
+            j = i
+            paren = j < len(tokens) and tokens[j][2] == '('
+            if paren:
+                j += 1
+            dname = tokens[j][0] if j < len(tokens) else None
+            if dname is None:
+                raise ValueError('invalid #if expression: {!r}'.format(expr))
+            j += 1
+            if paren:
+                if j >= len(tokens) or tokens[j][2] != ')':
+                    raise ValueError(
+                        'invalid #if expression: {!r}'.format(expr))
+                j += 1
+            if dname in known:
+                out.append('1' if dname in defines else '0')
+            else:
+                out.append(' '.join(t[0] or t[2] for t in tokens[i-1:j]))
+            i = j
+        elif name is not None and name in known and name not in defines:
+            out.append('0')
+        else:
+            out.append(name or number or op)
+    return ' '.join(out)
+
+def _eval_defined(name, defines, known):
+    """Evaluate the argument of #ifdef, or None if it is not known."""
+    name = name.strip()
+    if not re.fullmatch(r'[A-Za-z_]\w*', name):
+        raise ValueError('invalid macro name: {!r}'.format(name))
+    return name in defines if name in known else None
+
+def preprocess(text, defines, *, known=None):
+    """Evaluate conditional directives in GLSL source code.
+
+    defines: map from macro names to values
+    known: names of macros which are undefined unless they are in
+      defines, by default the names in defines
+
+    Lines excluded by #if, #ifdef, and #ifndef are removed.  The given
+    macros are defined at the top of the result, but only if they are
+    still used.  The result is the same for any set of macros which
+    selects the same code, so variants can be deduplicated.
+
+    Conditionals which depend on other macros, such as GL_ES, are kept
+    for the shader compiler.  Macros defined in the source code are
+    known after their definition.
+    """
+    defines = {k: str(v) for k, v in defines.items()}
+    outer = dict(defines)
+    known = set(defines if known is None else known)
+    known.update(defines)
+    known.difference_update(PREDEFINED)
+    # Stack of (parent, taken, kept) for each conditional.  Kept
+    # conditionals could not be evaluated, and their directives are
+    # copied to the output.
+    stack = []
+    active = True
+    lines = []
+    for line in text.splitlines():
+        s = line.strip()
+        if not s.startswith('#'):
+            if active:
+                lines.append(line)
+            continue
+        parts = s[1:].split(None, 1)
+        directive = parts[0] if parts else ''
+        arg = parts[1] if len(parts) > 1 else ''
+        arg = re.sub(r'/\*.*?\*/|//.*', ' ', arg).strip()
+        if directive in ('if', 'ifdef', 'ifndef'):
+            if not active:
+                stack.append((False, True, False))
+                continue
+            if directive == 'if':
+                cond = _eval_cond(arg, defines, known)
+            else:
+                cond = _eval_defined(arg, defines, known)
+                if cond is not None and directive == 'ifndef':
+                    cond = not cond
+            if cond is None:
+                stack.append((True, False, True))
+                if directive == 'if':
+                    line = '#if ' + _fold_cond(arg, defines, known)
+                lines.append(line)
+            else:
+                stack.append((True, cond, False))
+                active = cond
+        elif directive == 'elif':
+            parent, taken, kept = stack[-1]
+            if kept:
+                if parent:
+                    lines.append('#elif ' + _fold_cond(arg, defines, known))
+                active = parent
+            elif parent and not taken:
+                cond = _eval_cond(arg, defines, known)
+                if cond is None:
+                    # The earlier branches were removed, so this
+                    # branch starts the conditional in the output.
+                    stack[-1] = parent, False, True
+                    lines.append('#if ' + _fold_cond(arg, defines, known))
+                    active = True
+                else:
+                    stack[-1] = parent, cond, False
+                    active = cond
+            else:
+                active = False
+        elif directive == 'else':
+            parent, taken, kept = stack[-1]
+            if kept:
+                if parent:
+                    lines.append(line)
+                active = parent
+            else:
+                stack[-1] = parent, True, False
+                active = parent and not taken
+        elif directive == 'endif':
+            parent, taken, kept = stack.pop()
+            if kept and parent:
+                lines.append(line)
+            active = parent
+        elif active:
+            if directive == 'define':
+                m = re.match(r'([A-Za-z_]\w*)(\()?\s*(.*)', arg)
+                if not m:
+                    raise ValueError('invalid #define: {!r}'.format(arg))
+                name, paren, value = m.groups()
+                if paren:
+                    raise ValueError(
+                        'function-like macros are not supported: {}'
+                        .format(name))
+                if any(kept for parent, taken, kept in stack):
+                    # Whether this is defined depends on other macros.
+                    known.discard(name)
+                    defines.pop(name, None)
+                else:
+                    known.add(name)
+                    defines[name] = value.strip()
+            elif directive == 'undef':
+                name = arg.strip()
+                if any(kept for parent, taken, kept in stack):
+                    known.discard(name)
+                else:
+                    known.add(name)
+                defines.pop(name, None)
+            lines.append(line)
+    if stack:
+        raise ValueError('unterminated conditional')
+    used = set(re.findall(r'[A-Za-z_]\w*', '\n'.join(lines)))
+    header = ['#define {} {}'.format(k, v).rstrip()
+              for k, v in sorted(outer.items()) if k in used]
+    if lines and lines[0].strip().startswith('#version'):
+        lines[1:1] = header
+    else:
+        lines[0:0] = header
+    return '\n'.join(lines)
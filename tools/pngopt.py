@@ -0,0 +1,319 @@
+# Copyright 2016 Dietrich Epp.
+#
+# This file is part of Kitten Teleporter.  The Kitten Teleporter source
+# code is distributed under the terms of the MIT license.
+# See LICENSE.txt for details.
+"""PNG optimizer.
+
+Images are recompressed losslessly.  The smallest color type is chosen
+(grayscale, palette, with or without alpha), every PNG filter is tried
+along with per-row adaptive filtering, and the filtered data is
+compressed with several zlib strategies.  Only the IHDR, PLTE, tRNS,
+IDAT, and IEND chunks are written, so all metadata is removed.
+
+Optimized images can also be converted to lossless WebP, which is
+usually smaller, for clients which support it.
+
+If no encoding is smaller than the input, the input is kept as it is.
+Results are cached by the input contents, so each image is only
+optimized once.
+"""
+import concurrent.futures
+import hashlib
+import os
+import struct
+import tempfile
+import zlib
+
+# Change this to invalidate cached images.
+_CACHE_VERSION = 2
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# PNG color types.
+GRAY = 0
+RGB = 2
+PALETTE = 3
+GRAY_ALPHA = 4
+RGB_ALPHA = 6
+
+STRATEGIES = [zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED, zlib.Z_RLE]
+
+def _chunk(ctype, data):
+    return b''.join([
+        struct.pack('>I', len(data)),
+        ctype,
+        data,
+        struct.pack('>I', zlib.crc32(ctype + data) & 0xffffffff),
+    ])
+
+def _filters(arr, bpp):
+    """Apply all five PNG filters to an image.
+
+    arr: array of rows, uint8[height, width * bpp]
+    bpp: bytes per pixel
+
+    Returns int16[5, height, width * bpp], the result of each filter
+    modulo 256.
+    """
+    import numpy
+    x = arr.astype(numpy.int16)
+    a = numpy.zeros_like(x)
+    a[:,bpp:] = x[:,:-bpp]
+    b = numpy.zeros_like(x)
+    b[1:] = x[:-1]
+    c = numpy.zeros_like(x)
+    c[1:,bpp:] = x[:-1,:-bpp]
+    pa = numpy.abs(b - c)
+    pb = numpy.abs(a - c)
+    pc = numpy.abs(a + b - 2 * c)
+    paeth = numpy.where((pa <= pb) & (pa <= pc), a,
+                        numpy.where(pb <= pc, b, c))
+    return numpy.stack([
+        x,
+        x - a,
+        x - b,
+        x - (a + b) // 2,
+        x - paeth,
+    ]) & 0xff
+
+def _filtered_rows(arr, bpp):
+    """Get candidate filtered image data, before compression.
+
+    Yields the data for each filter applied to every row, and for the
+    filter chosen per row by the minimum sum of absolute differences.
+    """
+    import numpy
+    height = arr.shape[0]
+    f = _filters(arr, bpp)
+    ftype = numpy.arange(5, dtype=numpy.uint8)
+    def rows(types, data):
+        out = numpy.empty((height, data.shape[1] + 1), numpy.uint8)
+        out[:,0] = types
+        out[:,1:] = data
+        return out.tobytes()
+    for i in range(5):
+        yield rows(ftype[i], f[i])
+    cost = numpy.where(f >= 128, 256 - f, f).sum(axis=2)
+    best = numpy.argmin(cost, axis=0)
+    yield rows(best, f[best, numpy.arange(height)])
+
+def _compress(arr, bpp):
+    """Compress image rows, returning the smallest zlib stream."""
+    best = None
+    for data in _filtered_rows(arr, bpp):
+        obj = zlib.compressobj(9, zlib.DEFLATED, 15, 9)
+        out = obj.compress(data) + obj.flush()
+        if best is None or len(out) < len(best[1]):
+            best = data, out
+    data, best = best
+    # Only try other strategies with the best filter, which is usually
+    # the best filter for every strategy.
+    for strategy in STRATEGIES[1:]:
+        obj = zlib.compressobj(9, zlib.DEFLATED, 15, 9, strategy)
+        out = obj.compress(data) + obj.flush()
+        if len(out) < len(best):
+            best = out
+    return best
+
+def _encode(arr, color_type, palette=None, trns=None):
+    """Encode an 8-bit image as PNG.
+
+    arr: uint8[height, width, channels]
+    """
+    height, width, channels = arr.shape
+    chunks = [
+        PNG_SIGNATURE,
+        _chunk(b'IHDR', struct.pack(
+            '>IIBBBBB', width, height, 8, color_type, 0, 0, 0)),
+    ]
+    if palette is not None:
+        chunks.append(_chunk(b'PLTE', palette))
+    if trns:
+        chunks.append(_chunk(b'tRNS', trns))
+    chunks.append(_chunk(
+        b'IDAT', _compress(arr.reshape(height, width * channels), channels)))
+    chunks.append(_chunk(b'IEND', b''))
+    return b''.join(chunks)
+
+def _candidates(rgba, grayscale):
+    """Get the lossless encodings of an image to try.
+
+    Yields (array, color_type, palette, trns).
+    """
+    import numpy
+    color = rgba[:,:,:3]
+    alpha = rgba[:,:,3:]
+    if grayscale:
+        if (color == color[0,0]).all() and not (alpha == 255).all():
+            # Constant color, so all information is in the alpha.
+            yield alpha, GRAY, None, None
+        else:
+            yield (numpy.dot(color, [0.299, 0.587, 0.114]) + 0.5).astype(
+                numpy.uint8)[:,:,None], GRAY, None, None
+        return
+    opaque = (alpha == 255).all()
+    gray = ((color[:,:,0] == color[:,:,1]) &
+            (color[:,:,1] == color[:,:,2])).all()
+    if gray:
+        if opaque:
+            yield color[:,:,:1], GRAY, None, None
+        else:
+            yield rgba[:,:,[0,3]], GRAY_ALPHA, None, None
+    elif opaque:
+        yield color, RGB, None, None
+    else:
+        yield rgba, RGB_ALPHA, None, None
+    # Palette, with translucent entries first so tRNS can be short.
+    pixels = rgba.reshape(-1, 4)
+    keys = pixels.view(numpy.uint32).reshape(-1)
+    colors, index = numpy.unique(keys, return_inverse=True)
+    if len(colors) <= 256:
+        colors = colors.view(numpy.uint8).reshape(-1, 4)
+        order = numpy.lexsort((numpy.arange(len(colors)), colors[:,3] == 255))
+        remap = numpy.empty(len(colors), numpy.uint8)
+        remap[order] = numpy.arange(len(colors))
+        colors = colors[order]
+        ntrns = int((colors[:,3] != 255).sum())
+        yield (
+            remap[index].reshape(rgba.shape[0], rgba.shape[1], 1),
+            PALETTE,
+            colors[:,:3].tobytes(),
+            colors[:ntrns,3].tobytes(),
+        )
+
+def optimize(data, *, grayscale=False):
+    """Optimize a PNG image, and return the new PNG data.
+
+    grayscale: reduce the image to a single 8-bit gray channel, which
+    is lossy if the image has color.  If the image is a constant color
+    with an alpha channel, the alpha channel is kept as the gray
+    channel, otherwise the luminance is kept.
+
+    Returns the original data if it is smaller than every encoding,
+    and already grayscale if grayscale is set.
+    """
+    import io
+    import numpy
+    import PIL.Image
+    img = PIL.Image.open(io.BytesIO(data))
+    rgba = numpy.asarray(img.convert('RGBA'))
+    best = None
+    for arr, color_type, palette, trns in _candidates(rgba, grayscale):
+        out = _encode(numpy.ascontiguousarray(arr), color_type, palette, trns)
+        if best is None or len(out) < len(best):
+            best = out
+    if len(best) >= len(data) and (not grayscale or img.mode == 'L'):
+        return data
+    return best
+
+def webp(data):
+    """Convert a PNG image to lossless WebP, and return the WebP data."""
+    import io
+    import PIL.Image
+    img = PIL.Image.open(io.BytesIO(data))
+    fp = io.BytesIO()
+    img.save(fp, 'WEBP', lossless=True, quality=100, method=6, exact=True)
+    return fp.getvalue()
+
+FORMATS = ('png', 'webp')
+
+def _cache_key(path, grayscale):
+    obj = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        obj.update(fp.read())
+    obj.update(repr((_CACHE_VERSION, grayscale)).encode('UTF-8'))
+    return obj.hexdigest()[:32]
+
+def _write(path, data):
+    # Other processes may be writing the same file.
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path) or '.', prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(data)
+        os.replace(tmp_path, path)
+    except:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+def _optimize_file(path, outputs, grayscale):
+    """Optimize one file, writing each output format to the cache.
+
+    Returns the sizes of the input and each output.
+    """
+    with open(path, 'rb') as fp:
+        data = fp.read()
+    sizes = [len(data)]
+    try:
+        with open(outputs['png'], 'rb') as fp:
+            png = fp.read()
+    except FileNotFoundError:
+        png = optimize(data, grayscale=grayscale)
+        _write(outputs['png'], png)
+    for fmt, out_path in sorted(outputs.items()):
+        if fmt == 'png':
+            out = png
+        elif not os.path.exists(out_path):
+            out = webp(png)
+            _write(out_path, out)
+        else:
+            continue
+        sizes.append('{} {}'.format(len(out), fmt))
+    return sizes
+
+def optimize_files(paths, *, cache, grayscale=(), formats=('png',)):
+    """Optimize PNG files, using a cache directory.
+
+    paths: list of paths to PNG files
+    cache: path to the cache directory
+    grayscale: set of paths to reduce to grayscale
+    formats: output formats, from FORMATS
+
+    Returns a map from each input path to a map from each format to the
+    path of the optimized image in the cache.  Images not in the cache
+    are optimized in parallel.
+    """
+    for fmt in formats:
+        if fmt not in FORMATS:
+            raise ValueError('unknown image format: {!r}'.format(fmt))
+    result = {}
+    missing = []
+    for path in paths:
+        key = _cache_key(path, path in grayscale)
+        # The optimized PNG is also the input for other formats.
+        outputs = {fmt: os.path.join(cache, '{}.{}'.format(key, fmt))
+                   for fmt in set(formats) | {'png'}}
+        result[path] = {fmt: outputs[fmt] for fmt in formats}
+        if not all(os.path.exists(p) for p in outputs.values()):
+            missing.append((path, outputs, path in grayscale))
+    if not missing:
+        return result
+    os.makedirs(cache, exist_ok=True)
+    if len(missing) > 1:
+        with concurrent.futures.ProcessPoolExecutor() as pool:
+            futures = [pool.submit(_optimize_file, *args) for args in missing]
+            sizes = [f.result() for f in futures]
+    else:
+        sizes = [_optimize_file(*args) for args in missing]
+    for (path, outputs, gray), size in zip(missing, sizes):
+        print('Optimized {}: {} -> {} bytes'.format(
+            path, size[0], ', '.join(size[1:])))
+    return result
+
+if __name__ == '__main__':
+    import argparse
+    p = argparse.ArgumentParser('python -m tools.pngopt')
+    p.add_argument('--grayscale', action='store_true',
+                   help='reduce images to grayscale')
+    p.add_argument('--webp', action='store_true',
+                   help='also convert images to WebP')
+    p.add_argument('file', nargs='+', help='PNG files to optimize')
+    args = p.parse_args()
+    with tempfile.TemporaryDirectory() as cache:
+        gray = set(args.file) if args.grayscale else set()
+        optimize_files(args.file, cache=cache, grayscale=gray,
+                       formats=FORMATS if args.webp else ('png',))
@@ -0,0 +1,212 @@
+# Copyright 2016 Dietrich Epp.
+#
+# This file is part of Kitten Teleporter.  The Kitten Teleporter source
+# code is distributed under the terms of the MIT license.
+# See LICENSE.txt for details.
+"""Pre-forking server for a finished build.
+
+This serves the build directory without rebuilding, for playtests with
+many clients.  The server forks worker processes, so requests are not
+limited to one core.  Each worker listens on the same port with
+SO_REUSEPORT and the kernel spreads connections between them.  On
+systems without SO_REUSEPORT, the workers share one listening socket.
+Workers which exit are restarted.
+
+Request counters for all workers are kept in shared memory.  They are
+served as JSON at /_stats and printed when the server stops.
+"""
+import json
+import mmap
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+from wsgiref.simple_server import make_server
+from . import build
+from . import slow
+from .serve import Handler, ThreadingServer
+
+STATS_PATH = '/_stats'
+
+# Workers which exit sooner than this many seconds after starting
+# count as failures.  Too many failures in a row stop the server.
+_QUICK_EXIT = 1.0
+_MAX_FAILURES = 5
+
+class Counters(object):
+    """Request counters shared between worker processes.
+
+    Each worker has its own row, so workers do not contend for locks.
+    The memory is shared with processes forked after it is created.
+    """
+    __slots__ = ['workers', '_mem', '_values', '_lock']
+
+    FIELDS = [
+        'requests', 'status_2xx', 'status_3xx', 'status_4xx', 'status_5xx',
+        'bytes', 'restarts',
+    ]
+    _INDEX = {name: i for i, name in enumerate(FIELDS)}
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._mem = mmap.mmap(-1, 8 * len(self.FIELDS) * workers)
+        self._values = memoryview(self._mem).cast('Q')
+        # Protects the row of this process from its request threads.
+        self._lock = threading.Lock()
+
+    def add(self, slot, name, value=1):
+        """Add to a counter for a worker."""
+        i = slot * len(self.FIELDS) + self._INDEX[name]
+        with self._lock:
+            self._values[i] += value
+
+    def worker(self, slot):
+        """Get the counters for one worker, as a dictionary."""
+        i = slot * len(self.FIELDS)
+        return dict(zip(self.FIELDS, self._values[i:i+len(self.FIELDS)]))
+
+    def total(self):
+        """Get the counters summed over all workers."""
+        total = dict.fromkeys(self.FIELDS, 0)
+        for slot in range(self.workers):
+            for name, value in self.worker(slot).items():
+                total[name] += value
+        return total
+
+class CountingWrapper(object):
+    """WSGI wrapper which counts requests for one worker."""
+    __slots__ = ['app', 'counters', 'slot']
+
+    def __init__(self, app, counters, slot):
+        self.app = app
+        self.counters = counters
+        self.slot = slot
+
+    def __call__(self, environ, start_response):
+        if environ['PATH_INFO'] == STATS_PATH:
+            yield from self.stats(start_response)
+            return
+        status = None
+        def start(status_, headers, exc_info=None):
+            nonlocal status
+            status = status_
+            return start_response(status_, headers, exc_info)
+        self.counters.add(self.slot, 'requests')
+        size = 0
+        try:
+            for chunk in self.app(environ, start):
+                size += len(chunk)
+                yield chunk
+        finally:
+            self.counters.add(self.slot, 'bytes', size)
+            if status is not None and status[:1] in '2345':
+                self.counters.add(
+                    self.slot, 'status_{}xx'.format(status[:1]))
+
+    def stats(self, start_response):
+        """Serve the counters as JSON."""
+        c = self.counters
+        body = json.dumps({
+            'total': c.total(),
+            'workers': [c.worker(slot) for slot in range(c.workers)],
+        }, indent=2, sort_keys=True).encode('UTF-8')
+        start_response('200 Ok', [
+            ('Content-Type', 'application/json'),
+            ('Cache-Control', 'no-cache'),
+        ])
+        yield body
+
+class ReusePortServer(ThreadingServer):
+    """Server which shares its port with other processes."""
+    def server_bind(self):
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+def _run_worker(server, host, port, app):
+    """Run a worker process, with an inherited server or a new one."""
+    # The supervisor handles interrupts, and stops workers with SIGTERM.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    if server is None:
+        server = make_server(host, port, app, ReusePortServer)
+    else:
+        server.set_app(app)
+    server.serve_forever()
+
+def serve(config, *, workers, rate=None):
+    """Serve the build directory with a pool of worker processes."""
+    if not os.path.isfile('build/index.html'):
+        raise build.BuildFailure('No build to serve, run a build first')
+    host = config.server_host
+    port = config.server_port
+    counters = Counters(workers)
+    if hasattr(socket, 'SO_REUSEPORT'):
+        server = None
+    else:
+        server = make_server(host, port, None, ThreadingServer)
+    # Map from pid to (slot, start time).
+    children = {}
+
+    def spawn(slot):
+        app = Handler(None)
+        if rate is not None:
+            app = slow.SlowWrapper(app, rate=rate)
+        app = CountingWrapper(app, counters, slot)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                _run_worker(server, host, port, app)
+                status = 0
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                os._exit(status)
+        children[pid] = slot, time.monotonic()
+
+    def stop(signum, frame):
+        raise SystemExit(0)
+
+    old_handler = signal.signal(signal.SIGTERM, stop)
+    print('Serving build on http://{}:{}/ with {} workers'
+          .format(host, port, workers))
+    failures = 0
+    try:
+        for slot in range(workers):
+            spawn(slot)
+        while True:
+            pid, status = os.wait()
+            try:
+                slot, start = children.pop(pid)
+            except KeyError:
+                continue
+            if time.monotonic() - start < _QUICK_EXIT:
+                failures += 1
+                if failures >= _MAX_FAILURES:
+                    raise build.BuildFailure(
+                        'Workers are exiting immediately')
+            else:
+                failures = 0
+            print('Worker {} exited with status {}, restarting'
+                  .format(pid, status), file=sys.stderr)
+            counters.add(slot, 'restarts')
+            spawn(slot)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        signal.signal(signal.SIGTERM, old_handler)
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in children:
+            os.waitpid(pid, 0)
+        print('Requests:')
+        for name, value in sorted(counters.total().items()):
+            print('  {}: {}'.format(name, value))
@@ -3,58 +3,79 @@
 # This file is part of Kitten Teleporter.  The Kitten Teleporter source
 # code is distributed under the terms of the MIT license.
 # See LICENSE.txt for details.
-"""Rectangle bin packing."""
+"""Rectangle bin packing.
+
+Several packing methods are available:
+
+skyline: bottom-left skyline, fast and good for rects of similar height
+maxrects: MaxRects best short side fit, slower but denser
+guillotine: guillotine best area fit with shorter leftover axis split
+best: try all methods and keep the smallest packing
+
+If rotation is enabled, rects may be rotated 90 degrees.  Rotated rects
+have the rotated flag set, and their w and h are swapped from the input.
+"""
 import collections
 
-Rect = collections.namedtuple('Rect', 'x y w h')
+Rect = collections.namedtuple('Rect', 'x y w h rotated')
+Rect.__new__.__defaults__ = (False,)
 Packing = collections.namedtuple('Packing', 'width height rects')
 
 def _rect_key(r):
     # Widest rects, then tallest rects, then lowest index rects
     return -r[0], -r[1], r[2]
 
-def _try_pack(size, rects, result):
-    """Try to pack rectangles in the given bounds.
+def _rect_key_rotate(r):
+    # Longest sides, then shortest sides, then lowest index rects
+    return -max(r[0], r[1]), -min(r[0], r[1]), r[2]
+
+def _orientations(sx, sy, rotate):
+    """Get the (width, height, rotated) orientations to try for a rect."""
+    if rotate and sx != sy:
+        return (sx, sy, False), (sy, sx, True)
+    return (sx, sy, False),
+
+def _try_pack(size, rects, result, rotate=False):
+    """Try to pack rectangles in the given bounds with a skyline.
 
     size: (width, height)
     rects: array of (width, height, index)
     result: array to store result
+    rotate: allow rects to be rotated
 
     The (x, y) for each rect is stored in the rect's index in the
     result array.  Returns True if successful, False otherwise.
     """
     width, height = size
     node = [(0, 0)]
-    for sx, sy, idx in rects:
-        if not sx or not sy:
+    for rx, ry, idx in rects:
+        if not rx or not ry:
             result[idx] = Rect(0, 0, 0, 0)
             continue
-        maxx = width - sx
-        bestx = -1
-        besty = height + 1 - sy
-        first = -1
-        last = -1
-        for i, (x, y) in enumerate(node):
-            if x + sx > width:
-                break
-            if y >= besty:
-                continue
-            for j in range(i + 1, len(node)):
-                jx, jy = node[j]
-                if x + sx <= jx:
+        # Choose the position with the lowest top edge
+        best = None
+        besttop = height + 1
+        for sx, sy, rotated in _orientations(rx, ry, rotate):
+            for i, (x, y) in enumerate(node):
+                if x + sx > width:
                     break
-                y = max(y, jy)
-            else:
-                j = len(node)
-            if y >= besty:
-                continue
-            first = i
-            last = j
-            bestx = x
-            besty = y
-        if first < 0:
+                if y + sy >= besttop:
+                    continue
+                for j in range(i + 1, len(node)):
+                    jx, jy = node[j]
+                    if x + sx <= jx:
+                        break
+                    y = max(y, jy)
+                else:
+                    j = len(node)
+                if y + sy >= besttop:
+                    continue
+                best = i, j, x, y, sx, sy, rotated
+                besttop = y + sy
+        if best is None:
             return False
-        result[idx] = Rect(bestx, besty, sx, sy)
+        first, last, bestx, besty, sx, sy, rotated = best
+        result[idx] = Rect(bestx, besty, sx, sy, rotated)
         x0 = bestx
         x1 = bestx + sx
         y0 = besty
@@ -67,6 +88,118 @@ def _try_pack(size, rects, result):
         node[first:last] = nnode
     return True
 
+def _contains(a, b):
+    """Test whether rect a contains rect b, as (x, y, w, h) tuples."""
+    return (a[0] <= b[0] and a[1] <= b[1] and
+            b[0] + b[2] <= a[0] + a[2] and b[1] + b[3] <= a[1] + a[3])
+
+def _try_pack_maxrects(size, rects, result, rotate=False):
+    """Try to pack rectangles in the given bounds with MaxRects.
+
+    This keeps a list of maximal free rectangles, which may overlap,
+    and places each rect in the free rectangle where it leaves the
+    shortest leftover side.  Arguments are the same as _try_pack.
+    """
+    width, height = size
+    free = [(0, 0, width, height)]
+    for rx, ry, idx in rects:
+        if not rx or not ry:
+            result[idx] = Rect(0, 0, 0, 0)
+            continue
+        best = None
+        bestscore = None
+        for fx, fy, fw, fh in free:
+            for sx, sy, rotated in _orientations(rx, ry, rotate):
+                if sx > fw or sy > fh:
+                    continue
+                lx = fw - sx
+                ly = fh - sy
+                score = min(lx, ly), max(lx, ly), fy, fx
+                if bestscore is None or score < bestscore:
+                    best = Rect(fx, fy, sx, sy, rotated)
+                    bestscore = score
+        if best is None:
+            return False
+        result[idx] = best
+        x0, y0 = best.x, best.y
+        x1, y1 = x0 + best.w, y0 + best.h
+        # Split each free rect which overlaps the placed rect into up to
+        # four maximal rects around it.
+        keep = []
+        split = []
+        for f in free:
+            fx, fy, fw, fh = f
+            if x0 >= fx + fw or fx >= x1 or y0 >= fy + fh or fy >= y1:
+                keep.append(f)
+                continue
+            if x0 > fx:
+                split.append((fx, fy, x0 - fx, fh))
+            if x1 < fx + fw:
+                split.append((x1, fy, fx + fw - x1, fh))
+            if y0 > fy:
+                split.append((fx, fy, fw, y0 - fy))
+            if y1 < fy + fh:
+                split.append((fx, y1, fw, fy + fh - y1))
+        # Remove new free rects contained in other free rects.  The
+        # new rects are inside old free rects, so they cannot contain
+        # any of the free rects we kept.
+        split.sort(key=lambda f: -f[2] * f[3])
+        free = keep
+        for f in split:
+            if not any(_contains(g, f) for g in free):
+                free.append(f)
+    return True
+
+def _try_pack_guillotine(size, rects, result, rotate=False):
+    """Try to pack rectangles in the given bounds with guillotine cuts.
+
+    This keeps a list of disjoint free rectangles, places each rect in
+    the smallest free rectangle which fits, and splits the remainder
+    along the shorter leftover axis.  Arguments are the same as
+    _try_pack.
+    """
+    width, height = size
+    free = [(0, 0, width, height)]
+    for rx, ry, idx in rects:
+        if not rx or not ry:
+            result[idx] = Rect(0, 0, 0, 0)
+            continue
+        best = None
+        bestscore = None
+        for i, (fx, fy, fw, fh) in enumerate(free):
+            for sx, sy, rotated in _orientations(rx, ry, rotate):
+                if sx > fw or sy > fh:
+                    continue
+                score = fw * fh, min(fw - sx, fh - sy)
+                if bestscore is None or score < bestscore:
+                    best = i, Rect(fx, fy, sx, sy, rotated)
+                    bestscore = score
+        if best is None:
+            return False
+        i, r = best
+        result[idx] = r
+        fx, fy, fw, fh = free.pop(i)
+        lx = fw - r.w
+        ly = fh - r.h
+        if lx < ly:
+            # Cut horizontally, the right piece is only as tall as the rect
+            right = fx + r.w, fy, lx, r.h
+            below = fx, fy + r.h, fw, ly
+        else:
+            # Cut vertically, the piece below is only as wide as the rect
+            right = fx + r.w, fy, lx, fh
+            below = fx, fy + r.h, r.w, ly
+        for f in (right, below):
+            if f[2] and f[3]:
+                free.append(f)
+    return True
+
+METHODS = {
+    'skyline': _try_pack,
+    'maxrects': _try_pack_maxrects,
+    'guillotine': _try_pack_guillotine,
+}
+
 def _ilog2(x):
     """Compute the ceiling of the base-2 logarithm of a number."""
     i = 0
@@ -74,23 +207,41 @@ def _ilog2(x):
         i += 1
     return i
 
-def pack(rects, *, min_size=(16, 16), max_size=(2048, 2048)):
+def pack(rects, *, min_size=(16, 16), max_size=(2048, 2048),
+         method='skyline', rotate=False):
     """Find a packing for the given rectangles.
 
     The rects should be an array of (width, height) sizes.  This will
     return a Packing object, or None if packing fails.  Each rectangle
     the resulting packing will correspond to the input rectangle with
     the same array index.
+
+    method: name of packing method, or 'best' to try all methods
+    rotate: allow rects to be rotated 90 degrees
     """
+    if method == 'best':
+        funcs = [METHODS[name] for name in sorted(METHODS)]
+    else:
+        try:
+            funcs = [METHODS[method]]
+        except KeyError:
+            raise ValueError('unknown packing method: {!r}'.format(method))
     rects2 = [(x, y, i) for i, (x, y) in enumerate(rects)]
-    rects2.sort(key=_rect_key)
+    rects2.sort(key=_rect_key_rotate if rotate else _rect_key)
     minw, minh = min_size
     maxw, maxh = max_size
     maxa = maxw * maxh
-    minw = max(minw, max(x for x, y, i in rects2))
-    minh = max(minh, max(y for x, y, i in rects2))
+    if rotate:
+        side = max(min(x, y) for x, y, i in rects2)
+        minw = max(minw, side)
+        minh = max(minh, side)
+    else:
+        minw = max(minw, max(x for x, y, i in rects2))
+        minh = max(minh, max(y for x, y, i in rects2))
     mina = max(minw * minh, sum(x * y for x, y, i in rects2))
     result = [None] * len(rects2)
+    # Sizes are tried from smallest to largest, so the first success
+    # with any method is the smallest packing.
     for a in range(_ilog2(mina), _ilog2(maxa) * 2):
         sizes = []
         if not (a & 1):
@@ -101,8 +252,9 @@ def pack(rects, *, min_size=(16, 16), max_size=(2048, 2048)):
         sizes = [(1 << i, 1 << (a - i)) for i in sizes]
         for w, h in sizes:
             if minw <= w <= maxw and minh <= h <= maxh:
-                if _try_pack((w, h), rects2, result):
-                    return Packing(w, h, result)
+                for func in funcs:
+                    if func((w, h), rects2, result, rotate):
+                        return Packing(w, h, result)
     return None
 
 if __name__ == '__main__':
@@ -120,17 +272,21 @@ if __name__ == '__main__':
     test1()
 
     # Test using random rects
-    def test2(rsz, count):
+    def test2(rsz, count, method, rotate):
         import random
-        rects = [(random.randint(1, rsz), random.randint(1, rsz))
+        r = random.Random(count)
+        rects = [(r.randint(1, rsz), r.randint(1, rsz))
                  for i in range(count)]
-        p = pack(rects)
+        p = pack(rects, method=method, rotate=rotate)
         assert p is not None
         rarea = sum(r.w * r.h for r in p.rects)
         parea = p.width * p.height
-        print('Packed into {0.width}x{0.height} (eff: {1:0.4f})'
-              .format(p, rarea / parea))
-        for i, r in enumerate(p.rects):
+        name = method + (' rotate' if rotate else '')
+        print('{0}: packed into {1.width}x{1.height} (eff: {2:0.4f})'
+              .format(name, p, rarea / parea))
+        for i, (r, (w, h)) in enumerate(zip(p.rects, rects)):
+            assert (r.w, r.h) == ((h, w) if r.rotated else (w, h))
+            assert r.x + r.w <= p.width and r.y + r.h <= p.height
             for j, q in enumerate(p.rects):
                 if i == j:
                     continue
@@ -138,6 +294,8 @@ if __name__ == '__main__':
                     r.y < q.y + q.h and q.y < r.y + r.h):
                     print('Collision: {} {}'.format(r, q))
                     assert False
-        print('test2: success')
-    test2(50, 100)
-    test2(50, 1000)
+    for method in sorted(METHODS) + ['best']:
+        for rotate in (False, True):
+            test2(50, 100, method, rotate)
+            test2(50, 1000, method, rotate)
+    print('test2: success')
@@ -16,13 +16,16 @@ class ThreadingServer(ThreadingMixIn, WSGIServer):
 PLAIN_TEXT = ('Content-Type', 'text/plain;charset=UTF-8')
 
 CONTENT_TYPE = {
+    '.bin': 'application/octet-stream',
     '.html': 'text/html;charset=UTF-8',
     '.js': 'application/javascript',
     '.json': 'application/json',
     '.png': 'image/png',
     '.jpg': 'image/jpeg',
+    '.webp': 'image/webp',
     '.m4a': 'audio/mpeg4',
     '.ogg': 'audio/ogg',
+    '.pack': 'application/octet-stream',
 }
 
 def error_method_not_allowed(env, start_response):
@@ -43,6 +46,11 @@ def error_internal(env, start_response, text):
 SAFE = re.compile('^[-_A-Za-z0-9][-_.A-Za-z0-9]*$')
 
 class Handler(object):
+    """WSGI application serving the build directory.
+
+    app: application to rebuild when the page is loaded, or None to
+    serve the existing build
+    """
     def __init__(self, app):
         self.app = app
 
@@ -51,12 +59,17 @@ class Handler(object):
             return error_method_not_allowed(env, start_response)
         uri = env['PATH_INFO']
         if uri == '/':
-            try:
-                self.app.build()
-            except build.BuildFailure as ex:
-                return error_internal(env, start_response, ex)
+            if self.app is not None:
+                try:
+                    self.app.build()
+                except build.BuildFailure as ex:
+                    return error_internal(env, start_response, ex)
             path = 'index.html'
             cache_control = 'no-cache'
+        elif uri == '/sw.js':
+            # Browsers check the service worker for updates.
+            path = 'sw.js'
+            cache_control = 'no-cache'
         elif uri.startswith('/'):
             path = uri[1:]
             cache_control = 'max-age={}'.format(60*60*24)
@@ -5,14 +5,17 @@
 # See LICENSE.txt for details.
 """GLSL shader processor."""
 import collections
+import hashlib
 import io
 import json
 import os
 import re
 import yaml
 from . import build
+from . import glsl
 
 Shader = collections.namedtuple('Shader', 'text attributes uniforms')
+Module = collections.namedtuple('Module', 'code sources')
 
 DECL = re.compile(
     r'\s*(attribute|uniform)\s+'
@@ -23,10 +26,21 @@ DECL = re.compile(
 
 EXTS = {'.vert', '.frag'}
 
+# Cache of processed shaders, by file hash.
+_processed = {}
+# Cache of minified shaders, by (text hash, varying map).
+_minified = {}
+
 def process_glsl(config, path):
     """Process a GLSL shader."""
-    with open(path) as fp:
-        text = fp.read()
+    with open(path, 'rb') as fp:
+        data = fp.read()
+    key = hashlib.sha256(data).digest()
+    try:
+        return _processed[key]
+    except KeyError:
+        pass
+    text = data.decode('UTF-8')
     lines = []
     attributes = []
     uniforms = []
@@ -40,7 +54,27 @@ def process_glsl(config, path):
                 attributes.append(name)
             else:
                 uniforms.append(name)
-    return Shader('\n'.join(lines), attributes, uniforms)
+    sinfo = Shader('\n'.join(lines), attributes, uniforms)
+    _processed[key] = sinfo
+    return sinfo
+
+def minify_all(shaders):
+    """Minify a map of shaders, returning a new map.
+
+    Varyings are renamed consistently across all of the shaders.
+    """
+    rename = glsl.rename_varyings(s.text for s in shaders.values())
+    rkey = tuple(sorted(rename.items()))
+    result = {}
+    for name, sinfo in shaders.items():
+        key = hashlib.sha256(sinfo.text.encode('UTF-8')).digest(), rkey
+        try:
+            text = _minified[key]
+        except KeyError:
+            text = glsl.minify(sinfo.text, rename=rename)
+            _minified[key] = text
+        result[name] = sinfo._replace(text=text)
+    return result
 
 def as_list(x):
     if isinstance(x, str):
@@ -49,11 +83,56 @@ def as_list(x):
         return x
     raise TypeError('not a list or string')
 
+def as_defines(x):
+    if isinstance(x, dict):
+        return x
+    return {name: 1 for name in as_list(x)}
+
+def source_table(sources):
+    """Create a table of shader sources with duplicates removed.
+
+    Returns a dictionary with 'text', a list of distinct shader source
+    code, and 'index', a map from shader names to indexes in 'text'.
+    """
+    text = []
+    index = {}
+    by_hash = {}
+    for name, source in sorted(sources.items()):
+        key = hashlib.sha256(source.encode('UTF-8')).digest()
+        try:
+            i = by_hash[key]
+        except KeyError:
+            i = len(text)
+            text.append(source)
+            by_hash[key] = i
+        index[name] = i
+    return {'text': text, 'index': index}
+
 def process_all(config, info_path, shader_paths):
+    """Process all shaders.
+
+    Returns a Module, containing the TypeScript code for the shader
+    module and the table of shader source code.  The source code is
+    kept out of the TypeScript module, so changes to shader code do not
+    require recompiling the application.
+
+    Programs may declare variants, which map variant names to macro
+    definitions.  Each shader is preprocessed once for each variant,
+    and variants which produce identical code share the same source.
+    """
     path_map = {os.path.basename(path): path for path in shader_paths}
     with open(info_path) as fp:
         info = yaml.safe_load(fp)
     shaders = {}
+    # Map from (file, variant) to preprocessed Shader.
+    variants = {}
+    # Macros which select variants.  These are undefined in variants
+    # which do not define them, and other macros are left for the
+    # shader compiler.
+    known = set()
+    for value in info.values():
+        for defines in value.get('variants', {}).values():
+            known.update(as_defines(defines))
     fp = io.StringIO()
     fp.write(
         '// This file is automatically generated.\n'
@@ -62,6 +141,9 @@ def process_all(config, info_path, shader_paths):
         slist = {}
         attributes = set()
         uniforms = set()
+        pvariants = {'': {}}
+        for vname, defines in value.get('variants', {}).items():
+            pvariants[vname] = as_defines(defines)
         for stype in ('vert', 'frag'):
             pshaders = as_list(value[stype])
             for shader in pshaders:
@@ -73,6 +155,15 @@ def process_all(config, info_path, shader_paths):
                     shaders[fname] = sinfo
                 attributes.update(sinfo.attributes)
                 uniforms.update(sinfo.uniforms)
+                for vname, defines in pvariants.items():
+                    vkey = fname + ':' + vname if vname else fname
+                    vinfo = sinfo._replace(
+                        text=glsl.preprocess(sinfo.text, defines, known=known))
+                    if variants.get(vkey, vinfo) != vinfo:
+                        raise ValueError(
+                            '{}: conflicting definitions for variant {}'
+                            .format(name, vkey))
+                    variants[vkey] = vinfo
             slist[stype] = json.dumps(' '.join(sorted(pshaders)))
         iattr = as_list(value['attributes'])
         if sorted(iattr) != sorted(attributes):
@@ -90,12 +181,13 @@ def process_all(config, info_path, shader_paths):
             '\tfrag: {frag},\n'
             '\tunif: {uniforms},\n'
             '\tattr: {attributes},\n'
+            '\tvariants: {variants},\n'
             '}};\n'
             'export function {fname}'
-            '(gl: WebGLRenderingContext, vert: string, frag: string): '
-            '{name} {{\n'
+            '(gl: WebGLRenderingContext, vert: string, frag: string, '
+            'variant?: string): {name} {{\n'
             '\treturn <{name}> shader.loadProgram('
-            'gl, Sources, {name}Info, vert, frag);\n'
+            'gl, ShaderSources, {name}Info, vert, frag, variant);\n'
             '}}\n'
             .format(
                 name=name + 'Program',
@@ -105,23 +197,26 @@ def process_all(config, info_path, shader_paths):
                 frag=slist['frag'],
                 uniforms=json.dumps(' '.join(sorted(uniforms))),
                 attributes=json.dumps(' '.join(iattr)),
+                variants=json.dumps(' '.join(sorted(pvariants)).strip()),
                 ulines=''.join('\t{}: WebGLUniformLocation;\n'.format(x)
                                for x in sorted(uniforms)),
             ))
-    fp.write('\n')
-    fp.write(
-        'const Sources: {{ [name: string]: string }} = {};\n'
-        .format(json.dumps(
-            {k: v.text for k, v in shaders.items()},
-            sort_keys=True, indent=2)))
-    return fp.getvalue()
+    if not config.debug:
+        variants = minify_all(variants)
+    return Module(
+        fp.getvalue(),
+        source_table({k: v.text for k, v in variants.items()}))
 
 if __name__ == '__main__':
     def main():
         root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         sroot = os.path.join(root, 'shader')
-        text = process_all({}, os.path.join(sroot, 'info.yaml'),
-                           build.all_files(sroot, exts=EXTS))
         import sys
-        sys.stdout.write(text)
+        class Config(object):
+            debug = '--debug' in sys.argv
+        module = process_all(Config, os.path.join(sroot, 'info.yaml'),
+                             build.all_files(sroot, exts=EXTS))
+        sys.stdout.write(module.code)
+        json.dump(module.sources, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
     main()
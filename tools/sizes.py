@@ -0,0 +1,175 @@
+# Copyright 2016 Dietrich Epp.
+#
+# This file is part of Kitten Teleporter.  The Kitten Teleporter source
+# code is distributed under the terms of the MIT license.
+# See LICENSE.txt for details.
+"""Build output size report and size budgets.
+
+Sizes are measured raw, compressed with gzip, and compressed with
+brotli if the brotli module is installed.  Reports are saved for each
+version, so growth can be tracked between builds.
+"""
+import collections
+import fnmatch
+import gzip
+import json
+import os
+
+Sizes = collections.namedtuple('Sizes', 'raw gzip brotli')
+
+MEASURES = Sizes._fields
+
+# Directory where reports are saved, one for each version.
+REPORT_DIR = 'build/sizes'
+
+def measure(data):
+    """Measure the size of data, raw and compressed."""
+    try:
+        import brotli
+    except ImportError:
+        bsize = None
+    else:
+        bsize = len(brotli.compress(data))
+    return Sizes(len(data), len(gzip.compress(data, 9)), bsize)
+
+def _total(sizes):
+    total = []
+    for values in zip(*sizes):
+        if any(v is None for v in values):
+            total.append(None)
+        else:
+            total.append(sum(values))
+    return Sizes(*total) if total else Sizes(0, 0, 0)
+
+class Report(object):
+    """Size report for a build."""
+    __slots__ = [
+        # Version of the build.
+        'version',
+        # Map from file paths to Sizes.
+        'files',
+        # Map from module names in the application bundle to Sizes.
+        'modules',
+    ]
+
+    def __init__(self, version, files, modules):
+        self.version = version
+        self.files = files
+        self.modules = modules
+
+    @classmethod
+    def create(class_, version, root, paths, modules):
+        """Measure build outputs.
+
+        root: build directory
+        paths: paths of files relative to root
+        modules: map from module names to module code
+        """
+        files = {}
+        for path in paths:
+            with open(os.path.join(root, path), 'rb') as fp:
+                files[path] = measure(fp.read())
+        return class_(
+            version,
+            files,
+            {name: measure(data) for name, data in modules.items()})
+
+    def matching(self, pattern):
+        """Get the total size of all files matching a pattern."""
+        return _total([sizes for path, sizes in self.files.items()
+                       if fnmatch.fnmatch(path, pattern)])
+
+    def check_budget(self, budget):
+        """Check the sizes against a budget.
+
+        The budget maps file patterns to maps from measures to limits in
+        bytes.  Returns a list of budget violations.
+        """
+        errors = []
+        for pattern, limits in sorted(budget.items()):
+            sizes = self.matching(pattern)
+            for name, limit in sorted(limits.items()):
+                if name not in MEASURES:
+                    raise ValueError(
+                        'unknown size measure: {!r}'.format(name))
+                size = getattr(sizes, name)
+                if size is not None and size > limit:
+                    errors.append('{} is {} bytes {}, budget is {}'.format(
+                        pattern, size, name, limit))
+        return errors
+
+    def dump(self, *, previous=None):
+        """Print the report, with changes since a previous report."""
+        def row(name, sizes, old):
+            cols = []
+            for value in sizes:
+                if value is None:
+                    cols.append('{:>9}'.format('-'))
+                else:
+                    cols.append('{:9d}'.format(value))
+            line = '  {:<36} {}'.format(name, ' '.join(cols))
+            if old is not None and old.gzip is not None:
+                delta = sizes.gzip - old.gzip
+                if delta:
+                    line += '  ({:+d} gzip)'.format(delta)
+            print(line)
+        def section(title, items, old_items, key):
+            print('{:<38} {:>9} {:>9} {:>9}'.format(title, *MEASURES))
+            old_keyed = {key(name): sizes for name, sizes in old_items.items()}
+            for name, sizes in sorted(items.items()):
+                row(name, sizes, old_keyed.get(key(name)))
+            row('total', _total(items.values()),
+                _total(old_items.values()) if old_items else None)
+        if previous is not None:
+            print('Sizes for {}, changes since {}:'.format(
+                self.version, previous.version))
+        else:
+            print('Sizes for {}:'.format(self.version))
+        section('Files', self.files,
+                previous.files if previous else {}, strip_hash)
+        if self.modules:
+            section('Application modules', self.modules,
+                    previous.modules if previous else {}, lambda x: x)
+            print('  Module sizes are approximate: each module is '
+                  'minified and compressed')
+            print('  on its own, without the bundle wrapper.')
+
+    def save(self, directory=REPORT_DIR):
+        """Save the report, and return the path."""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, self.version + '.json')
+        with open(path, 'w') as fp:
+            json.dump({
+                'version': self.version,
+                'files': {k: v._asdict() for k, v in self.files.items()},
+                'modules': {k: v._asdict() for k, v in self.modules.items()},
+            }, fp, indent=2, sort_keys=True)
+        return path
+
+    @classmethod
+    def load(class_, path):
+        with open(path) as fp:
+            data = json.load(fp)
+        return class_(
+            data['version'],
+            {k: Sizes(**v) for k, v in data['files'].items()},
+            {k: Sizes(**v) for k, v in data['modules'].items()})
+
+def strip_hash(path):
+    """Remove the cache-busting hash from a path, to match builds."""
+    parts = os.path.basename(path).split('.')
+    if len(parts) > 2 and len(parts[-2]) == 8:
+        del parts[-2]
+    return os.path.join(os.path.dirname(path), '.'.join(parts))
+
+def previous_report(version, directory=REPORT_DIR):
+    """Get the most recent saved report for a different version."""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return None
+    paths = [os.path.join(directory, name) for name in names
+             if name.endswith('.json') and name != version + '.json']
+    if not paths:
+        return None
+    return Report.load(max(paths, key=os.path.getmtime))
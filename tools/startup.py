@@ -0,0 +1,129 @@
+# Copyright 2016 Dietrich Epp.
+#
+# This file is part of Kitten Teleporter.  The Kitten Teleporter source
+# code is distributed under the terms of the MIT license.
+# See LICENSE.txt for details.
+"""Startup time check for the command-line tool.
+
+This times 'python -m tools build' end to end when nothing needs to be
+rebuilt, in a new process each time.  The build state saved by the
+previous build lets the new process skip every target.  The slowest
+imports in that build are reported, using -X importtime.
+
+This is run by 'npm test', which fails if the build is over budget or
+rebuilds anything.
+"""
+import collections
+import os
+import subprocess
+import sys
+import time
+
+ImportTime = collections.namedtuple('ImportTime', 'module self cumulative')
+
+# Budget for a no-op build, in seconds.
+BUDGET = 1.0
+
+# Arguments for the build.  The daemon is not used, so this measures
+# the work done by the tool itself.
+BUILD_ARGS = ['-m', 'tools', 'build', '--no-daemon']
+
+def _parse_import_times(text):
+    """Parse the output of -X importtime."""
+    times = []
+    for line in text.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3:
+            continue
+        try:
+            tself = int(parts[0])
+            tcumulative = int(parts[1])
+        except ValueError:
+            continue
+        times.append(ImportTime(parts[2].strip(), tself, tcumulative))
+    return times
+
+def import_times(module, *, cwd=None):
+    """Get the import times for a module, in microseconds.
+
+    Returns a list of ImportTime objects, in the order that the
+    interpreter reports them.
+    """
+    proc = subprocess.Popen(
+        [sys.executable, '-X', 'importtime', '-c',
+         'import {}'.format(module)],
+        cwd=cwd,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE)
+    stdout, stderr = proc.communicate()
+    if proc.returncode != 0:
+        raise Exception('Could not import {}:\n{}'.format(
+            module, stderr.decode('UTF-8')))
+    return _parse_import_times(stderr.decode('UTF-8'))
+
+def run_build(*, cwd, importtime=False):
+    """Run a build in a new process.
+
+    Returns (elapsed, output), where elapsed is the wall time in
+    seconds and output is the text written to standard error.
+    """
+    cmd = [sys.executable]
+    if importtime:
+        cmd.extend(('-X', 'importtime'))
+    cmd.extend(BUILD_ARGS)
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        cmd,
+        cwd=cwd,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE)
+    stdout, stderr = proc.communicate()
+    elapsed = time.perf_counter() - start
+    stderr = stderr.decode('UTF-8')
+    if proc.returncode != 0:
+        raise Exception('Build failed:\n{}'.format(stderr))
+    return elapsed, stderr
+
+def check(*, budget=BUDGET, count=5):
+    """Check that a no-op build stays within the budget.
+
+    Prints the time and the slowest imports, and returns True if the
+    build is within budget and did not rebuild anything.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    # The first build brings the outputs and the saved build state up
+    # to date and writes .pyc files, so the later builds have nothing
+    # to do.
+    run_build(cwd=root)
+    best = None
+    for i in range(count):
+        elapsed, output = run_build(cwd=root)
+        if best is None or elapsed < best[0]:
+            best = elapsed, output
+    elapsed, output = best
+    rebuilt = [line for line in output.splitlines()
+               if line.startswith('Rebuilding ')]
+    if rebuilt:
+        print('The build is not a no-op:')
+        for line in rebuilt:
+            print('  ' + line)
+    # Import times are measured separately, since -X importtime slows
+    # down the interpreter.
+    times = _parse_import_times(run_build(cwd=root, importtime=True)[1])
+    times.sort(key=lambda t: -t.self)
+    print('Slowest imports:')
+    for t in times[:10]:
+        print('  {:8.1f} ms  {}'.format(t.self * 1e-3, t.module))
+    print('Imports: {:.1f} ms'.format(sum(t.self for t in times) * 1e-3))
+    print('No-op build: {:.1f} ms (budget {:.1f} ms)'
+          .format(elapsed * 1e3, budget * 1e3))
+    if elapsed > budget:
+        print('No-op build is over budget')
+        return False
+    return not rebuilt
+
+if __name__ == '__main__':
+    if not check():
+        raise SystemExit(1)
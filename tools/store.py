@@ -0,0 +1,168 @@
+# Copyright 2016 Dietrich Epp.
+#
+# This file is part of Kitten Teleporter.  The Kitten Teleporter source
+# code is distributed under the terms of the MIT license.
+# See LICENSE.txt for details.
+"""Shared store for build outputs.
+
+The store is a directory of files named by the hash of everything
+used to create them, so it can be shared by several checkouts and by
+build jobs running at the same time.  Files are written to a temporary
+name and renamed into place, so readers never see a partial file.
+When the store gets too large, the least recently used files are
+removed.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+# Change this to invalidate stored files.
+_STORE_VERSION = 1
+
+# Temporary files older than this many seconds were left by a build
+# which did not finish, and are removed.
+_TMP_AGE = 3600
+
+def _file_mode():
+    """Get the mode for new files, from the umask.
+
+    Temporary files are created with mode 0600, but the store may be
+    shared with other users.
+    """
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+_FILE_MODE = _file_mode()
+
+def key(*parts):
+    """Get the store key for a list of JSON values."""
+    obj = hashlib.sha256()
+    obj.update(json.dumps(
+        [_STORE_VERSION, parts], sort_keys=True,
+        separators=(',', ':')).encode('UTF-8'))
+    return obj.hexdigest()
+
+class Store(object):
+    """A directory of build outputs, named by key."""
+    __slots__ = [
+        # Path to the store directory.
+        'path',
+        # Maximum total size of the files in bytes.
+        'max_size',
+        # Estimated total size of the files, or None if not scanned.
+        '_size',
+    ]
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self._size = None
+
+    def _path(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def get(self, key):
+        """Get the data for a key, or None if it is not stored."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as fp:
+                data = fp.read()
+        except (FileNotFoundError, PermissionError):
+            return None
+        # The modification time records the last use, for eviction.
+        # Files written by other users may not allow this.
+        try:
+            os.utime(path)
+        except (FileNotFoundError, PermissionError):
+            pass
+        return data
+
+    def put(self, key, data):
+        """Store the data for a key."""
+        path = self._path(key)
+        dirname = os.path.dirname(path)
+        os.makedirs(dirname, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(data)
+                os.fchmod(fp.fileno(), _FILE_MODE)
+            os.replace(tmp_path, path)
+        except:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        if self._size is None:
+            self._size = self._scan()[1]
+        else:
+            self._size += len(data)
+        if self._size > self.max_size:
+            self.evict()
+
+    def _scan(self):
+        """List the stored files.
+
+        Returns ([(mtime, size, path)], total size).  Stale temporary
+        files are removed.
+        """
+        files = []
+        total = 0
+        now = time.time()
+        try:
+            dirnames = os.listdir(self.path)
+        except FileNotFoundError:
+            return files, total
+        for dirname in dirnames:
+            dirname = os.path.join(self.path, dirname)
+            try:
+                names = os.listdir(dirname)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            for name in names:
+                path = os.path.join(dirname, name)
+                try:
+                    st = os.stat(path)
+                    if name.startswith('.tmp-'):
+                        if now - st.st_mtime > _TMP_AGE:
+                            os.unlink(path)
+                        continue
+                except FileNotFoundError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        return files, total
+
+    def evict(self):
+        """Remove the least recently used files until the store fits.
+
+        Other processes may be using the store, so files may disappear
+        at any time.
+        """
+        files, total = self._scan()
+        files.sort()
+        for mtime, size, path in files:
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            except PermissionError:
+                continue
+            total -= size
+        self._size = total
+
+def open_store(info):
+    """Open the store from the store configuration.
+
+    Returns None if the store is not configured.
+    """
+    path = info.get('path')
+    if not path:
+        return None
+    return Store(os.path.expanduser(path), info['max_size'])
@@ -0,0 +1,352 @@
+# Copyright 2016 Dietrich Epp.
+#
+# This file is part of Kitten Teleporter.  The Kitten Teleporter source
+# code is distributed under the terms of the MIT license.
+# See LICENSE.txt for details.
+"""Text layout for static strings.
+
+Strings in assets/text.yaml are laid out with the font metadata from
+FontSet.pack, so the game does not have to lay them out at run time.
+This is a copy of text.Builder in src/text.ts, and must give the same
+results, including its rounding and line breaking.  The layouts are
+listed in assets/layout.yaml.
+"""
+import collections
+import fnmatch
+import math
+import os
+import struct
+import yaml
+
+SPEC = 'assets/layout.yaml'
+
+# Kerning is disabled in src/text.ts, and baked layouts must match.
+KERNING = False
+
+ATTR_SPACE, ATTR_LB, ATTR_PB = 1, 2, 3
+ATTR_MAP = {
+    ' ': ATTR_SPACE,
+    '\n': ATTR_PB,
+    '\u2028': ATTR_LB,
+    '\u2029': ATTR_PB,
+}
+
+ALIGN = {'left': 0, 'right': 1, 'center': 2, 'justify': 3}
+LEFT, RIGHT, CENTER, JUSTIFY = range(4)
+
+PENALTY_BREAK = 1
+PENALTY_RAGGED = 20
+PENALTY_OVERWIDE = 2000
+
+# Number of int16 values for each glyph: rect pos, rect tex, style.
+GLYPH_SIZE = 10
+
+Metrics = collections.namedtuple('Metrics', 'x0 y0 x1 y1 adv')
+Layout = collections.namedtuple('Layout', 'glyphs metrics')
+
+class _Break(object):
+    __slots__ = ['attr', 'idx', 'idx_trim', 'adv', 'adv_trim',
+                 'prev', 'penalty']
+
+    def __init__(self, attr, idx, idx_trim, adv, adv_trim):
+        self.attr = attr
+        self.idx = idx
+        self.idx_trim = idx_trim
+        self.adv = adv
+        self.adv_trim = adv_trim
+        self.prev = None
+        self.penalty = 0
+
+def _trunc(x):
+    """Convert a number the way an Int16Array does, for small values."""
+    return int(x)
+
+class Builder(object):
+    """A builder for text layouts, like text.Builder."""
+    __slots__ = ['_gadv', '_gdat', '_gatt',
+                 '_ascender', '_descender', '_lineheight']
+
+    def __init__(self):
+        self._gadv = []
+        self._gdat = []
+        self._gatt = []
+        self._ascender = 0
+        self._descender = 0
+        self._lineheight = 0
+
+    def add(self, finfo, text, *, scale=1, style=0):
+        """Add text to the end of the text flow.
+
+        finfo: font metadata from FontSet.pack
+        """
+        self._ascender = max(self._ascender, finfo['ascender'] * scale)
+        self._descender = min(self._descender, finfo['descender'] * scale)
+        self._lineheight = max(self._lineheight, finfo['height'] * scale)
+        glyph = finfo['glyph']
+        char = finfo['char']
+        i0 = len(self._gadv)
+        gidx = []
+        for c in text:
+            g = char.find(c)
+            if g >= 0:
+                adv, sx, sy, bx, by, tx, ty = glyph[g*7:g*7+7]
+                adv *= scale
+                x0 = scale * bx
+                x1 = x0 + scale * sx
+                y1 = scale * by
+                y0 = y1 - scale * sy
+                dat = [x0, y0, x1, y1, tx, ty + sy, tx + sx, ty]
+            else:
+                g = 0
+                adv = 0
+                dat = [0] * 8
+            gidx.append(g)
+            self._gadv.append(_trunc(adv))
+            self._gdat.append([_trunc(x) for x in dat] + [style, 0])
+            self._gatt.append(ATTR_MAP.get(c, 0))
+        if KERNING and finfo.get('kern'):
+            kern = {(left, right): amount
+                    for left, right, amount in finfo['kern']}
+            for i in range(len(gidx) - 1):
+                amount = kern.get((gidx[i], gidx[i + 1]))
+                if amount is not None:
+                    self._gadv[i0 + i] = _trunc(
+                        self._gadv[i0 + i] + amount * scale)
+
+    def _break_text(self, width, align, indent, lineheight):
+        """Calculate line break positions.
+
+        Returns a list of lines (x, y, width, g0, g1).
+        """
+        gadv = self._gadv
+        gatt = self._gatt
+        n = len(gadv)
+        if not n:
+            return []
+        lines = []
+        br = [_Break(ATTR_PB, 0, 0, 0, 0)]
+        gatt[n - 1] = ATTR_PB
+        adv = adv_trim = idx = idx_trim = 0
+        while idx < n:
+            attr = gatt[idx]
+            adv += gadv[idx]
+            idx += 1
+            if attr != ATTR_SPACE:
+                adv_trim = adv
+                idx_trim = idx
+            if not attr:
+                continue
+            if attr == ATTR_SPACE:
+                if width <= 0 or (idx + 1 < n and gatt[idx + 1]):
+                    continue
+            br.append(_Break(attr, idx, idx_trim, adv, adv_trim))
+            if attr != ATTR_PB:
+                continue
+            for i in range(1, len(br)):
+                bi = br[i]
+                best_penalty = float('inf')
+                best_break = None
+                for j in range(i - 1, -1, -1):
+                    bj = br[j]
+                    bwidth = bi.adv_trim - bj.adv
+                    twidth = width
+                    if bj.attr == ATTR_PB:
+                        twidth -= indent
+                    penalty = bj.penalty + PENALTY_BREAK
+                    delta = (bwidth - twidth) / lineheight
+                    if bi.attr == ATTR_PB:
+                        if bwidth > twidth:
+                            penalty += delta * delta * PENALTY_RAGGED
+                            penalty += PENALTY_OVERWIDE
+                    else:
+                        penalty += delta * delta * PENALTY_RAGGED
+                        if bwidth > twidth:
+                            penalty += PENALTY_OVERWIDE
+                    if penalty < best_penalty or best_break is None:
+                        best_penalty = penalty
+                        best_break = bj
+                    if bj.attr != ATTR_SPACE:
+                        break
+                bi.penalty = best_penalty
+                bi.prev = best_break
+            b = br[-1].prev
+            while b.prev is not None:
+                b.attr = ATTR_LB
+                b = b.prev
+            for b in br[1:]:
+                if b.attr == ATTR_SPACE:
+                    continue
+                p = b.prev
+                lwidth = b.adv_trim - p.adv
+                x = 0
+                twidth = width
+                if p.attr == ATTR_PB:
+                    twidth -= indent
+                    x += indent
+                delta = twidth - lwidth
+                g0 = p.idx
+                g1 = b.idx_trim
+                if align == RIGHT:
+                    x += delta
+                elif align == CENTER:
+                    x += _trunc(delta) >> 1
+                elif align == JUSTIFY and b.attr != ATTR_PB:
+                    nwhite = sum(1 for j in range(g0, g1)
+                                 if gatt[j] == ATTR_SPACE)
+                    wpos = 0
+                    wlast = 0
+                    for j in range(g0, g1):
+                        if gatt[j] == ATTR_SPACE:
+                            wpos += 1
+                            wcur = math.floor(delta * wpos / nwhite + 0.5)
+                            gadv[j] += wcur - wlast
+                            wlast = wcur
+                lines.append([x, 0, lwidth, g0, g1])
+            first = br[0]
+            first.idx = first.idx_trim = idx_trim = idx
+            first.adv = first.adv_trim = adv_trim = adv
+            del br[1:]
+        ypos = 0
+        for line in lines:
+            line[1] = ypos
+            ypos -= lineheight
+        return lines
+
+    def finish(self, *, width=0, lineheight=None, align=LEFT, indent=0):
+        """Finish creating the text layout, and return it.
+
+        The glyphs in the layout are the glyphs which are drawn, each a
+        list of GLYPH_SIZE values, as in the array from text.Builder.
+        """
+        if lineheight is None:
+            lineheight = self._lineheight
+        lines = self._break_text(width, align, indent, lineheight)
+        x0 = y0 = x1 = y1 = 0
+        for i, (x, y, lwidth, g0, g1) in enumerate(lines):
+            lx0 = x
+            ly0 = y + self._descender
+            lx1 = x + lwidth
+            ly1 = y + self._ascender
+            if i == 0:
+                x0, y0, x1, y1 = lx0, ly0, lx1, ly1
+            else:
+                x0 = min(x0, lx0)
+                y0 = min(y0, ly0)
+                x1 = max(x1, lx1)
+                y1 = max(y1, ly1)
+        gdat = self._gdat
+        gadv = self._gadv
+        adv = 0
+        for i, a in enumerate(gadv):
+            adv += a
+            gdat[i][9] = adv
+        for x, y, lwidth, g0, g1 in lines:
+            for j in range(g0, g1):
+                d = gdat[j]
+                d[0] = _trunc(d[0] + x)
+                d[1] = _trunc(d[1] + y)
+                d[2] = _trunc(d[2] + x)
+                d[3] = _trunc(d[3] + y)
+                x += gadv[j]
+        glyphs = [d for d in gdat if d[0] != d[2] and d[1] != d[3]]
+        return Layout(glyphs, Metrics(x0, y0, x1, y1, adv))
+
+def _flatten(obj, prefix=''):
+    """Get all strings in a YAML document by dotted key."""
+    if isinstance(obj, str):
+        yield prefix, obj
+    elif isinstance(obj, dict):
+        for key, value in obj.items():
+            yield from _flatten(value, prefix + '.' + key if prefix else key)
+
+def load_spec(path):
+    """Load the layout specification.
+
+    Returns a list of (name, text, options), where options is a
+    dictionary with font, scale, style, width, lineheight, align, and
+    indent.
+    """
+    with open(path) as fp:
+        spec = yaml.safe_load(fp)
+    root = os.path.dirname(path)
+    texts = {}
+    result = {}
+    for lspec in spec:
+        lspec = dict(lspec)
+        tpath = os.path.join(root, lspec.pop('text', 'text.yaml'))
+        if tpath not in texts:
+            with open(tpath) as fp:
+                texts[tpath] = dict(_flatten(yaml.safe_load(fp)))
+        strings = texts[tpath]
+        patterns = lspec.pop('keys')
+        options = {
+            'font': lspec.pop('font'),
+            'scale': lspec.pop('scale', 1),
+            'style': lspec.pop('style', 0),
+            'width': lspec.pop('width', 0),
+            'lineheight': lspec.pop('lineheight', None),
+            'align': lspec.pop('align', 'left'),
+            'indent': lspec.pop('indent', 0),
+        }
+        if lspec:
+            raise ValueError('{}: unknown layout options: {}'.format(
+                path, ', '.join(sorted(lspec))))
+        if options['align'] not in ALIGN:
+            raise ValueError('{}: unknown alignment: {!r}'.format(
+                path, options['align']))
+        for pattern in patterns:
+            names = [name for name in strings
+                     if fnmatch.fnmatchcase(name, pattern)]
+            if not names:
+                raise ValueError('{}: no strings match {!r}'.format(
+                    path, pattern))
+            for name in names:
+                result[name] = strings[name], options
+    return [(name, text, options)
+            for name, (text, options) in sorted(result.items())]
+
+def spec_deps(path):
+    """Get the files which the layout specification depends on."""
+    with open(path) as fp:
+        spec = yaml.safe_load(fp)
+    root = os.path.dirname(path)
+    return sorted({path} | {os.path.join(root, lspec.get('text', 'text.yaml'))
+                            for lspec in spec})
+
+def layout(fonts, text, options):
+    """Lay out one string.
+
+    fonts: font metadata from FontSet.pack
+    """
+    b = Builder()
+    b.add(fonts[options['font']], text,
+          scale=options['scale'], style=options['style'])
+    return b.finish(
+        width=options['width'],
+        lineheight=options['lineheight'],
+        align=ALIGN[options['align']],
+        indent=options['indent'])
+
+def bake(spec_path, fonts, *, offset=0):
+    """Lay out the strings in a layout specification.
+
+    fonts: font metadata from FontSet.pack, before encoding
+
+    Returns (info, bdata).  The binary data contains little-endian
+    int16[count * GLYPH_SIZE] for each layout.  The info maps each
+    string name to the offset of its glyphs, plus offset, the glyph
+    count, and the metrics.
+    """
+    out = bytearray()
+    info = {}
+    for name, text, options in load_spec(spec_path):
+        lay = layout(fonts, text, options)
+        values = [v for g in lay.glyphs for v in g]
+        linfo = {
+            'offset': offset + len(out),
+            'count': len(lay.glyphs),
+        }
+        linfo.update(lay.metrics._asdict())
+        info[name] = linfo
+        out += struct.pack('<{}h'.format(len(values)), *values)
+    return info, bytes(out)
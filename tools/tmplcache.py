@@ -0,0 +1,48 @@
+# Copyright 2016 Dietrich Epp.
+#
+# This file is part of Kitten Teleporter.  The Kitten Teleporter source
+# code is distributed under the terms of the MIT license.
+# See LICENSE.txt for details.
+"""Cache for compiled Mako templates.
+
+Compiling a Mako template is much slower than rendering it, and the
+server rebuilds the application on every page load.  Templates are
+kept here for the lifetime of the process, keyed on their source text
+or on their path and modification time.
+"""
+import os
+from mako import template
+
+# Compiled templates from strings, by source text.
+_text_cache = {}
+# Compiled templates from files, by path: (mtime, template).
+_file_cache = {}
+
+def from_text(text):
+    """Get a compiled template from source text."""
+    try:
+        return _text_cache[text]
+    except KeyError:
+        pass
+    tmpl = template.Template(text)
+    _text_cache[text] = tmpl
+    return tmpl
+
+def from_file(path, *, module_directory=None):
+    """Get a compiled template from a file.
+
+    If module_directory is set, the compiled Python modules are also
+    stored there, so they survive across runs.
+    """
+    mtime = os.stat(path).st_mtime
+    try:
+        cmtime, tmpl = _file_cache[path]
+    except KeyError:
+        pass
+    else:
+        if cmtime == mtime:
+            return tmpl
+    tmpl = template.Template(
+        filename=path, module_directory=module_directory)
+    _file_cache[path] = mtime, tmpl
+    return tmpl
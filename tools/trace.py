@@ -0,0 +1,150 @@
+# Copyright 2016 Dietrich Epp.
+#
+# This file is part of Kitten Teleporter.  The Kitten Teleporter source
+# code is distributed under the terms of the MIT license.
+# See LICENSE.txt for details.
+"""Build tracing.
+
+When tracing is enabled, the build system records spans for each
+target it builds and each command it runs.  The trace can be saved in
+the Chrome trace event format, and viewed in chrome://tracing.
+Tracing is disabled by default and costs almost nothing when off.
+"""
+import collections
+import contextlib
+import json
+import os
+import resource
+import threading
+import time
+
+class Tracer(object):
+    """A collection of trace events."""
+    __slots__ = ['events', 'start', 'pid']
+
+    def __init__(self):
+        self.events = []
+        self.start = time.perf_counter()
+        self.pid = os.getpid()
+
+    def now(self):
+        """Get the current timestamp, in microseconds."""
+        return (time.perf_counter() - self.start) * 1e6
+
+_tracer = None
+
+def enable():
+    """Start recording trace events."""
+    global _tracer
+    _tracer = Tracer()
+
+@contextlib.contextmanager
+def span(name, cat='build', **args):
+    """Record a span covering the body of a with statement.
+
+    The context value is the dictionary of span arguments, which the
+    body may modify.
+    """
+    t = _tracer
+    if t is None:
+        yield args
+        return
+    t0 = t.now()
+    try:
+        yield args
+    finally:
+        t.events.append({
+            'name': name,
+            'cat': cat,
+            'ph': 'X',
+            'ts': t0,
+            'dur': t.now() - t0,
+            'pid': t.pid,
+            'tid': threading.get_ident(),
+            'args': args,
+        })
+
+@contextlib.contextmanager
+def command(cmd):
+    """Record a span for running a command.
+
+    The CPU time is measured from the resource usage of child
+    processes, so commands must not run concurrently.
+    """
+    if _tracer is None:
+        yield
+        return
+    r0 = resource.getrusage(resource.RUSAGE_CHILDREN)
+    with span(os.path.basename(cmd[0]), 'command') as args:
+        try:
+            yield
+        finally:
+            r1 = resource.getrusage(resource.RUSAGE_CHILDREN)
+            args['user'] = r1.ru_utime - r0.ru_utime
+            args['sys'] = r1.ru_stime - r0.ru_stime
+
+def save(path):
+    """Save the trace to a file in Chrome trace event format."""
+    if _tracer is None:
+        return
+    dirname = os.path.dirname(path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    with open(path, 'w') as fp:
+        json.dump({
+            'traceEvents': _tracer.events,
+            'displayTimeUnit': 'ms',
+        }, fp)
+    print('Wrote trace to {}'.format(path))
+
+class _Target(object):
+    __slots__ = ['path', 'time', 'builder', 'hits', 'misses', 'bytes']
+
+    def __init__(self, path):
+        self.path = path
+        self.time = 0
+        self.builder = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+
+def summary(count=10):
+    """Print a table of the slowest targets."""
+    if _tracer is None:
+        return
+    targets = {}
+    commands = []
+    for event in _tracer.events:
+        if event['cat'] == 'command':
+            commands.append(event)
+            continue
+        args = event['args']
+        try:
+            target = targets[args['path']]
+        except KeyError:
+            target = _Target(args['path'])
+            targets[target.path] = target
+        name = event['name']
+        if name == 'build':
+            target.time += event['dur']
+            if args.get('cache') == 'hit':
+                target.hits += 1
+            else:
+                target.misses += 1
+        elif name == 'builder':
+            target.builder += event['dur']
+        elif name == 'write':
+            target.bytes += args['bytes']
+    targets = sorted(targets.values(), key=lambda t: -t.time)
+    print('Slowest targets:')
+    print('  {:>9}  {:>9}  {:>4}  {:>4}  {:>9}  {}'.format(
+        'total', 'builder', 'hit', 'miss', 'written', 'path'))
+    for t in targets[:count]:
+        print('  {:7.1f}ms  {:7.1f}ms  {:4}  {:4}  {:9}  {}'.format(
+            t.time * 1e-3, t.builder * 1e-3, t.hits, t.misses, t.bytes,
+            t.path))
+    wall = sum(e['dur'] for e in commands) * 1e-6
+    cpu = sum(e['args'].get('user', 0) + e['args'].get('sys', 0)
+              for e in commands)
+    print('Commands: {}, {:.2f}s wall, {:.2f}s CPU'
+          .format(len(commands), wall, cpu))